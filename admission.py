@@ -0,0 +1,251 @@
+# admission.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows - conversations are then only serialized within one process
+    fcntl = None
+
+
+class Rejected(Exception):
+    """A request turned away before generation; carries the HTTP status to answer with"""
+
+    def __init__(self, reason, status, message, retry_after=None):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def _granted():
+    future = Future()
+    future.set_running_or_notify_cancel()
+    future.set_result(True)
+    return future
+
+
+class WaitQueue:
+    """Semaphore whose waiters are Futures in a bounded FIFO queue.
+
+    acquire() hands back a Future that resolves once the caller holds a slot (already
+    resolved if one was free), or None if the queue is full. Futures can be waited on
+    from threads (result()) and asyncio (asyncio.wrap_future) alike. A waiter that gives
+    up calls give_up(), which returns False if the slot was handed over meanwhile, in
+    which case the caller holds it after all and must release it.
+    """
+
+    def __init__(self, limit, max_waiting):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active < self.limit:
+                self.active += 1
+                return _granted()
+            if len(self._waiters) >= self.max_waiting:
+                # Waiters that timed out stay queued until a release skips them; don't count them
+                self._waiters = deque(f for f in self._waiters if not f.cancelled())
+                if len(self._waiters) >= self.max_waiting:
+                    return None
+            future = Future()
+            self._waiters.append(future)
+            return future
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                # Hand the slot straight to the next waiter that hasn't given up
+                waiter = self._waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(True)
+                    return
+            self.active -= 1
+
+    @staticmethod
+    def give_up(future):
+        return future.cancel()
+
+    @property
+    def waiting(self):
+        with self._lock:
+            return sum(1 for f in self._waiters if not f.cancelled())
+
+    @property
+    def idle(self):
+        return self.active == 0 and not self._waiters
+
+
+class ConversationLocks:
+    """One WaitQueue of size 1 per conversation, created on demand and dropped when idle"""
+
+    def __init__(self, max_waiting):
+        self.max_waiting = max_waiting
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, conversation_id):
+        with self._lock:
+            queue = self._queues.get(conversation_id)
+            if queue is None:
+                queue = self._queues[conversation_id] = WaitQueue(1, self.max_waiting)
+            return queue.acquire()
+
+    def release(self, conversation_id):
+        with self._lock:
+            queue = self._queues.get(conversation_id)
+            if queue is None:
+                return
+            queue.release()
+            if queue.idle:
+                del self._queues[conversation_id]
+
+    def __len__(self):
+        return len(self._queues)
+
+
+class ProcessLocks:
+    """Per-conversation locks shared by every worker process on the host: one byte-range lock per conversation in one file.
+
+    A conversation id hashes to a byte offset, which is locked with fcntl.lockf without
+    blocking. The OS drops a process's locks when it exits, so a crashed worker never
+    leaves a conversation locked. Record locks belong to the process rather than the
+    thread, so callers must hold the conversation's ConversationLocks lock first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @staticmethod
+    def _offset(conversation_id):
+        return int.from_bytes(hashlib.blake2b(conversation_id.encode("utf-8"), digest_size=6).digest(), "big")
+
+    def try_acquire(self, conversation_id):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self._offset(conversation_id))
+            return True
+        except OSError:  # Held by another process
+            return False
+
+    def release(self, conversation_id):
+        # Unlocking a byte this process doesn't hold is a no-op
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._offset(conversation_id))
+
+
+class TokenBuckets:
+    """Per-client token buckets (rate per second, burst size), least recently seen clients forgotten first"""
+
+    def __init__(self, rate, burst, max_clients=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        self._buckets = OrderedDict()  # client -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """Seconds until a token is available, or 0.0 if one was taken now"""
+        if self.rate <= 0:
+            return 0.0
+        now = self._clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class Admission:
+    """Admission control for chat requests.
+
+    In order: the client's token bucket, then the conversation's lock (one generation
+    per conversation; later requests queue or are refused with 409), then a global slot
+    (at most `max_concurrent` generations, a bounded queue behind them, 429 beyond).
+    With `process_locks` (workers sharing a conversation backend) the conversation's
+    lock is also taken across processes. The waits themselves are done by the serving
+    path, so threads and coroutines can share one controller.
+    """
+
+    PROCESS_LOCK_POLL = 0.05  # Seconds between tries for a conversation locked by another worker
+
+    def __init__(self, rate=0.0, burst=10, max_concurrent=128, max_waiting=256, wait_timeout=10.0,
+                 conversation_policy="queue", conversation_waiting=4, conversation_timeout=30.0, process_locks=None):
+        self.buckets = TokenBuckets(rate, burst)
+        self.slots = WaitQueue(max_concurrent, max_waiting)
+        self.conversations = ConversationLocks(conversation_waiting if conversation_policy == "queue" else 0)
+        self.process_locks = process_locks if fcntl is not None else None
+        self.wait_timeout = wait_timeout
+        self.conversation_timeout = conversation_timeout if conversation_policy == "queue" else 0.0
+        self._lock = threading.Lock()
+        self.rejected = {"rate": 0, "conversation": 0, "overload": 0}
+
+    def check_rate(self, client):
+        wait = self.buckets.take(client)
+        if wait:
+            raise self._reject("rate", 429, "Slow down - even I need a second between suits.", wait)
+
+    def conversation_lock(self, conversation_id):
+        future = self.conversations.acquire(conversation_id)
+        if future is None:
+            raise self.conversation_busy()
+        return future
+
+    def process_lock(self, conversation_id):
+        """Sans-IO: take the conversation's lock across worker processes (after conversation_lock).
+
+        Yields seconds to sleep between tries and returns whether the lock was taken
+        within the conversation timeout.
+        """
+        if self.process_locks is None:
+            return True
+        deadline = time.monotonic() + self.conversation_timeout
+        while not self.process_locks.try_acquire(conversation_id):
+            if time.monotonic() + self.PROCESS_LOCK_POLL > deadline:
+                return False
+            yield self.PROCESS_LOCK_POLL
+        return True
+
+    def release_conversation(self, conversation_id):
+        if self.process_locks is not None:
+            self.process_locks.release(conversation_id)
+        self.conversations.release(conversation_id)
+
+    def conversation_busy(self):
+        return self._reject("conversation", 409, "I'm still answering your last message in this conversation. One genius thought at a time.")
+
+    def slot(self):
+        future = self.slots.acquire()
+        if future is None:
+            raise self.overloaded()
+        return future
+
+    def overloaded(self):
+        return self._reject("overload", 429, "Arc reactor at capacity. Try again in a moment.", 1.0)
+
+    def _reject(self, reason, status, message, retry_after=None):
+        with self._lock:
+            self.rejected[reason] += 1
+        return Rejected(reason, status, message, retry_after)
+
+    def stats(self):
+        return {
+            "active": self.slots.active,
+            "waiting": self.slots.waiting,
+            "conversations_locked": len(self.conversations),
+            "rejected": dict(self.rejected),
+        }
@@ -1,13 +1,29 @@
 # app.py
 import json
 import os
+import queue
+import re
 import uuid
 import time
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-from openai import OpenAI
 from dotenv import load_dotenv
+import math
 import threading
+import atexit
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from conversation_store import ConversationStore, open_backend
+from snapshots import Snapshotter
+from context_window import ContextWindow, extractive_summary
+from response_cache import ResponseCache, SingleFlight, cache_key
+from intents import IntentMatcher
+from llm_backends import open_llm_backend
+from model_routes import ModelRouter
+from static_assets import IMMUTABLE, StaticAsset
+from admission import Admission, ProcessLocks, Rejected, WaitQueue
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, Upstream
+from metrics import Metrics
+from tracing import Tracer, current_trace, span
 
 # Load environment variables
 load_dotenv()
@@ -16,18 +32,47 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize OpenAI client
-try:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("⚠️ WARNING: OPENAI_API_KEY not found - app will start but chat won't work")
-        client = None
-    else:
-        client = OpenAI(api_key=api_key)
-        print("✅ OpenAI client initialized successfully!")
-except Exception as e:
-    print(f"⚠️ OpenAI initialization failed: {e}")
-    client = None
+# Serverless cold starts: with lazy init (default on Vercel) the OpenAI client - and the openai
+# package behind it - is created by the first chat that needs it, and the page is compressed on
+# first request, so a fresh instance answers health checks and the page without paying for either
+LAZY_INIT = os.getenv("STARK_LAZY_INIT", "1" if os.getenv("VERCEL") else "0") == "1"
+
+# OpenAI client ("mock" answers locally, for load tests and offline development)
+LLM_BACKEND = os.getenv("STARK_LLM_BACKEND", "openai")
+client = None
+_client_ready = False
+_client_lock = threading.Lock()
+
+def init_client():
+    """Create the LLM client; None when it can't be (no API key, or init failed)"""
+    try:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if LLM_BACKEND == "mock":
+            llm = open_llm_backend("mock")
+            print("✅ Mock LLM backend initialized - no OpenAI calls will be made")
+        elif not api_key:
+            print("⚠️ WARNING: OPENAI_API_KEY not found - app will start but chat won't work")
+            llm = None
+        else:
+            llm = open_llm_backend(LLM_BACKEND, api_key)
+            print("✅ OpenAI client initialized successfully!")
+    except Exception as e:
+        print(f"⚠️ OpenAI initialization failed: {e}")
+        llm = None
+    return llm
+
+def get_client():
+    """The LLM client, created on first use (at import unless LAZY_INIT)"""
+    global client, _client_ready
+    if client is None and not _client_ready:
+        with _client_lock:
+            if not _client_ready:
+                client = init_client()
+                _client_ready = True
+    return client
+
+if not LAZY_INIT:
+    get_client()
 
 # EXACT ORIGINAL SYSTEM PROMPT - DO NOT MODIFY
 SYSTEM_PROMPT = """
@@ -73,8 +118,34 @@ IMPORTANT: You must respond in JSON format with the following structure:
 Remember: You're not just smart, you're Tony Stark smart. Every response should ooze genius and charm.
 """
 
-# In-memory conversation storage
-conversations = {}
+# Conversation storage: a bounded in-memory LRU, optionally caching a shared backend
+# ("sqlite" or "log") so any number of worker processes can serve the same conversation
+CONVERSATION_TTL = float(os.getenv("STARK_CONVERSATION_TTL", 6 * 3600))
+conversations = ConversationStore(
+    max_conversations=int(os.getenv("STARK_MAX_CONVERSATIONS", 10000)),
+    max_bytes=int(os.getenv("STARK_MAX_CONVERSATION_BYTES", 100 * 1024 * 1024)),
+    ttl=CONVERSATION_TTL,
+    backend=open_backend(
+        os.getenv("STARK_STORE_BACKEND", "memory"),
+        path=os.getenv("STARK_STORE_PATH"),
+        batch_delay=float(os.getenv("STARK_STORE_BATCH_DELAY_MS", 0)) / 1000,
+        ttl=CONVERSATION_TTL
+    )
+)
+
+# Opt-in snapshots of the in-memory store, so a restart doesn't forget every conversation
+# (the shared backends are durable already)
+snapshotter = None
+SNAPSHOT_PATH = os.getenv("STARK_SNAPSHOT_PATH")
+if SNAPSHOT_PATH and conversations.backend is None:
+    snapshotter = Snapshotter(conversations, SNAPSHOT_PATH, interval=float(os.getenv("STARK_SNAPSHOT_INTERVAL", 60)))
+    try:
+        if snapshotter.restore():
+            print(f"✅ Restored {snapshotter.restored} conversations ({snapshotter.last_bytes} bytes) in {snapshotter.restore_seconds * 1000:.1f}ms")
+    except Exception as e:
+        print(f"⚠️ Could not restore conversations from {SNAPSHOT_PATH}: {e}")
+    snapshotter.start()
+    atexit.register(snapshotter.save)
 
 # EXACT ORIGINAL FALLBACK RESPONSES
 FALLBACK_RESPONSES = {
@@ -84,75 +155,834 @@ FALLBACK_RESPONSES = {
     "how are you": "Fantastic, as always. Just finished upgrading the Mark 52 suit. It now makes espresso. Priorities, right?"
 }
 
-def generate_stark_response(message, conversation_id):
-    """Generate Tony Stark's response with thinking steps - EXACT ORIGINAL LOGIC"""
+# History sent upstream is windowed to a token budget; older turns are folded into a rolling summary
+CONTEXT_TOKEN_BUDGET = int(os.getenv("STARK_CONTEXT_TOKEN_BUDGET", 4000))
+SUMMARY_MODE = os.getenv("STARK_SUMMARY_MODE", "llm")  # "llm" or "extractive"
+SUMMARY_MODEL = os.getenv("STARK_SUMMARY_MODEL", "gpt-3.5-turbo")
+SUMMARY_MAX_TOKENS = int(os.getenv("STARK_SUMMARY_MAX_TOKENS", 300))
+
+SUMMARY_PROMPT = """
+You maintain Tony Stark's memory of a long chat. Merge the previous summary and the new turns into one
+concise summary (under 200 words) of the facts, requests and decisions that matter for continuing the
+conversation. Reply with the summary text only.
+"""
+
+def _summarize(previous, turns, deadline_at):
+    """Sub-pipeline that folds older turns into the rolling summary: a "summary" route call, or a local extract"""
+    # The summary may take at most half of what's left of the request deadline, so the
+    # reply itself still has time; with under a second for it, summarize locally
+    timeout = min(UPSTREAM_TIMEOUT, (deadline_at - time.monotonic()) / 2)
+    if SUMMARY_MODE == "llm" and timeout >= 1 and upstream.breaker.available():
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+        try:
+            content = yield "call", dict(
+                model_router.request_kwargs("summary"),
+                route="summary",
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"}
+                ],
+                timeout=timeout
+            )
+            return content.strip()
+        except Exception as e:
+            print(f"⚠️ Summarization failed, using local summary: {e}")
+    return extractive_summary(previous, turns, SUMMARY_MAX_TOKENS)
+
+def _build_context(conversation_id, history, deadline_at):
+    """Sub-pipeline that returns the windowed messages to send upstream, summarizing through the driver when needed"""
+    windowing = context_window.window(conversation_id, history)
+    summary = None
+    while True:
+        # Only the local work is timed here; a summary call is recorded as an upstream call
+        with span("context_window", messages=len(history)):
+            try:
+                previous, turns = windowing.send(summary)
+            except StopIteration as done:
+                return done.value
+        summary = yield from _summarize(previous, turns, deadline_at)
+
+context_window = ContextWindow(budget=CONTEXT_TOKEN_BUDGET)
+
+# Local intent fast path: canned answers for small talk without calling the API
+INTENT_ALIASES = {
+    "who are you": ["who r u", "what are you", "who is this", "whos this", "introduce yourself", "tell me about yourself"],
+    "help": ["help me", "i need help", "can you help", "can you help me", "what can you do"],
+    "hello": ["hi", "hey", "hiya", "yo", "sup", "whats up", "greetings", "good morning", "good afternoon", "good evening", "hello there"],
+    "how are you": ["how r u", "how are you doing", "hows it going", "how is it going", "how do you do"]
+}
+INTENT_FAST_PATH = os.getenv("STARK_INTENT_FAST_PATH", "1") == "1"
+INTENT_THRESHOLD = float(os.getenv("STARK_INTENT_THRESHOLD", 1.0))  # 1.0: every content word must be covered
+# Looser threshold used when the model is unavailable - a near miss beats an error message
+INTENT_DEGRADED_THRESHOLD = float(os.getenv("STARK_INTENT_DEGRADED_THRESHOLD", 0.3))
+
+if os.getenv("STARK_INTENTS_FILE"):
+    intent_matcher = IntentMatcher.from_file(os.getenv("STARK_INTENTS_FILE"), threshold=INTENT_THRESHOLD)
+else:
+    intent_matcher = IntentMatcher.from_responses(FALLBACK_RESPONSES, INTENT_ALIASES, threshold=INTENT_THRESHOLD)
+
+def intent_steps(intent):
+    """Well-formed thinking steps for a locally matched intent"""
+    return [
+        {
+            "step": "analyze",
+            "content": f"Pattern recognized: '{intent.name}'. I've answered this one more times than I've saved the world.",
+            "final": False
+        },
+        {"step": "result", "content": intent.response, "final": True}
+    ]
+
+# Exact-match cache of generated steps, keyed on the normalized message plus the history it was asked on,
+# and coalescing of concurrent identical requests into one generation
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("STARK_RESPONSE_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("STARK_RESPONSE_CACHE_TTL", 600))
+)
+response_flights = SingleFlight()
+
+# Opt-in semantic cache for first-turn questions asked in different words (needs numpy)
+semantic_cache = None
+if os.getenv("STARK_SEMANTIC_CACHE", "0") == "1":
+    try:
+        from semantic_cache import SemanticCache
+        semantic_cache = SemanticCache(
+            capacity=int(os.getenv("STARK_SEMANTIC_CACHE_SIZE", 2048)),
+            threshold=float(os.getenv("STARK_SEMANTIC_CACHE_THRESHOLD", 0.92))
+        )
+        SEMANTIC_CACHE_PATH = os.getenv("STARK_SEMANTIC_CACHE_PATH")
+        if SEMANTIC_CACHE_PATH:
+            if os.path.exists(SEMANTIC_CACHE_PATH):
+                print(f"✅ Semantic cache warmed with {semantic_cache.load(SEMANTIC_CACHE_PATH)} answers")
+            atexit.register(semantic_cache.save, SEMANTIC_CACHE_PATH)
+    except ImportError:
+        print("⚠️ STARK_SEMANTIC_CACHE needs numpy - semantic cache disabled")
+
+# Lock-free (per-thread) metrics for /api/metrics
+metrics = Metrics()
+metrics.gauge("stark_requests_in_flight", "Chat requests currently being generated")
+metrics.histogram("stark_request_seconds", "Wall time of a chat request")
+metrics.histogram("stark_step_seconds", "Time to produce each thinking step, by step type", labels=("step",))
+metrics.histogram("stark_steps_per_request", "Thinking steps returned per request", buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15))
+metrics.histogram("stark_upstream_seconds", "Latency of each OpenAI call", labels=("model", "kind"))
+metrics.counter("stark_upstream_errors_total", "Failed OpenAI calls", labels=("model", "error"))
+metrics.counter("stark_tokens_total", "Tokens billed by OpenAI", labels=("model", "type"))
+metrics.counter("stark_route_calls_total", "OpenAI calls per routing table entry and the model it picked", labels=("route", "model"))
+metrics.histogram("stark_route_seconds", "Latency of OpenAI calls per route", labels=("route", "model"))
+metrics.counter("stark_route_cost_usd_total", "Estimated OpenAI spend per route in USD, from token usage", labels=("route", "model"))
+metrics.counter("stark_json_fallbacks_total", "Model replies that were not valid step JSON", labels=("mode",))
+metrics.counter("stark_truncated_total", "Requests cut short by the step budget or deadline", labels=("reason",))
+metrics.counter("stark_errors_total", "Requests answered with an error", labels=("stage",))
+
+# Sampled request tracing: spans per phase, kept in a ring buffer for /api/debug/traces.
+# With STARK_PROFILING=1, a request sent with "X-Stark-Profile: 1" is also run under cProfile.
+tracer = Tracer(
+    sample_rate=float(os.getenv("STARK_TRACE_SAMPLE_RATE", 0)),
+    capacity=int(os.getenv("STARK_TRACE_BUFFER", 200))
+)
+PROFILING_ENABLED = os.getenv("STARK_PROFILING", "0") == "1"
+
+# Hard limits per request, so a model that never reaches "result" can't hold a worker for minutes.
+# Requests may ask for tighter limits (max_steps / deadline), never looser ones.
+MAX_STEPS = int(os.getenv("STARK_MAX_STEPS", 8))  # Model calls per request
+REQUEST_DEADLINE = float(os.getenv("STARK_REQUEST_DEADLINE", 90))  # Seconds
+UPSTREAM_TIMEOUT = float(os.getenv("STARK_UPSTREAM_TIMEOUT", 60))  # Seconds per model call
+
+BUDGET_MESSAGES = {
+    "steps": "I've been overthinking this one, and even I have to ship eventually.",
+    "deadline": "Clock's up. Even the Mark 85 has a flight ceiling."
+}
+
+def synthesize_result(steps, reason):
+    """Final step built from what was gathered before the step budget or deadline ran out"""
+    metrics.inc("stark_truncated_total", (reason,))
+    last = steps[-1] if steps else None
+    if last and last.get("step") == "output":
+        # The answer was already formulated, it just never got delivered
+        content = last.get("content", "")
+    else:
+        content = BUDGET_MESSAGES[reason]
+        if last:
+            content += f" Here's where my genius got to: {last.get('content', '')}"
+    return {"step": "result", "content": content, "final": True, "truncated": reason}
+
+# Upstream resilience: transient errors are retried with jittered exponential backoff, and after
+# STARK_BREAKER_THRESHOLD failures in a row the breaker answers locally for STARK_BREAKER_RESET seconds.
+# With STARK_HEDGE=1, a call slower than the recent STARK_HEDGE_PERCENTILE latency gets a duplicate sent.
+upstream = Upstream(
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("STARK_BREAKER_THRESHOLD", 5)),
+        reset_timeout=float(os.getenv("STARK_BREAKER_RESET", 30))
+    ),
+    max_retries=int(os.getenv("STARK_UPSTREAM_RETRIES", 2)),
+    base_delay=float(os.getenv("STARK_RETRY_BASE_DELAY", 0.25)),
+    max_delay=float(os.getenv("STARK_RETRY_MAX_DELAY", 4)),
+    latency=LatencyTracker(percentile=float(os.getenv("STARK_HEDGE_PERCENTILE", 95))) if os.getenv("STARK_HEDGE", "0") == "1" else None
+)
+_hedge_pool = None
+
+BREAKER_MESSAGE = (
+    "JARVIS tells me the uplink is down, so I'm running on backup power. "
+    "Give me a minute to reroute and ask me again - genius needs bandwidth."
+)
+
+# Admission control: per-client rate limit, one generation at a time per conversation
+# (later ones queue, or get a 409 with STARK_CONVERSATION_POLICY=reject), and a global cap on
+# concurrent generations with a bounded wait queue - beyond that, requests get a 429 right away.
+# With a shared backend the conversation lock also holds across the worker processes on this host.
+admission = Admission(
+    rate=float(os.getenv("STARK_RATE_LIMIT", 2)),
+    burst=int(os.getenv("STARK_RATE_BURST", 20)),
+    max_concurrent=int(os.getenv("STARK_MAX_CONCURRENT", 128)),
+    max_waiting=int(os.getenv("STARK_ADMISSION_QUEUE", 256)),
+    wait_timeout=float(os.getenv("STARK_ADMISSION_WAIT", 10)),
+    conversation_policy=os.getenv("STARK_CONVERSATION_POLICY", "queue"),
+    conversation_waiting=int(os.getenv("STARK_CONVERSATION_QUEUE", 4)),
+    conversation_timeout=float(os.getenv("STARK_CONVERSATION_WAIT", 30)),
+    process_locks=ProcessLocks(f"{conversations.backend.path}.locks") if conversations.backend is not None else None
+)
+# Behind a proxy (Railway, Heroku, nginx) the client address comes from X-Forwarded-For:
+# STARK_TRUST_PROXY is how many proxies in front of the app append to it (0: don't trust it)
+TRUST_PROXY = int(os.getenv("STARK_TRUST_PROXY", 0))
+
+# Thinking workflow, in the order the model walks through it
+STEP_ORDER = ["analyze", "think", "validate", "output", "result"]
+
+# Generation mode: "stepwise" makes one API call per step, "single" asks for every step in one call
+GENERATION_MODES = ("stepwise", "single")
+GENERATION_MODE = os.getenv("STARK_GENERATION_MODE", "stepwise")
+if GENERATION_MODE not in GENERATION_MODES:
+    print(f"⚠️ Unknown STARK_GENERATION_MODE '{GENERATION_MODE}' - using stepwise")
+    GENERATION_MODE = "stepwise"
+SINGLE_CALL_MAX_TOKENS = int(os.getenv("STARK_SINGLE_CALL_MAX_TOKENS", 1500))
+
+# Model per step: STARK_MODEL_ROUTES is a JSON routing table (or the path of one), e.g.
+# {"default": {"model": "gpt-4o-mini", "max_tokens": 250}, "result": {"model": "gpt-4-turbo-preview", "max_tokens": 500}}
+BUILTIN_ROUTES = {
+    "default": {"model": "gpt-4-turbo-preview", "temperature": 0.8, "max_tokens": 500},
+    "single": {"max_tokens": SINGLE_CALL_MAX_TOKENS},
+    "summary": {"model": SUMMARY_MODEL, "temperature": 0.2, "max_tokens": SUMMARY_MAX_TOKENS}
+}
+try:
+    model_router = ModelRouter.from_config(os.getenv("STARK_MODEL_ROUTES", "{}"), STEP_ORDER, BUILTIN_ROUTES)
+except (OSError, ValueError) as e:
+    print(f"⚠️ Invalid STARK_MODEL_ROUTES ({e}) - every step uses {BUILTIN_ROUTES['default']['model']}")
+    model_router = ModelRouter({}, STEP_ORDER, BUILTIN_ROUTES)
+
+# Appended after the conversation in single-call mode so SYSTEM_PROMPT itself stays untouched
+SINGLE_CALL_PROMPT = """
+For this reply, work through ALL five steps at once. Respond with a single JSON object of the form:
+{
+    "steps": [
+        {"step": "analyze", "content": "...", "final": false},
+        {"step": "think", "content": "...", "final": false},
+        {"step": "validate", "content": "...", "final": false},
+        {"step": "output", "content": "...", "final": false},
+        {"step": "result", "content": "Your full answer", "final": true}
+    ]
+}
+"""
+
+class StepContentStreamer:
+    """Incrementally extract the "step" and "content" strings from a JSON step object streamed in chunks"""
+
+    STEP_RE = re.compile(r'"step"\s*:\s*"([^"\\]*)"')
+    CONTENT_RE = re.compile(r'"content"\s*:\s*"')
+
+    def __init__(self):
+        self.text = ""
+        self.step = None
+        self.done = False
+        self._pos = None  # Index of the next undecoded character inside the content string
+
+    def feed(self, chunk):
+        """Add a chunk of raw JSON and return any newly decoded content text"""
+        self.text += chunk
+        if self.step is None:
+            match = self.STEP_RE.search(self.text)
+            if match:
+                self.step = match.group(1)
+        if self._pos is None:
+            match = self.CONTENT_RE.search(self.text)
+            if not match:
+                return ""
+            self._pos = match.end()
+        if self.done:
+            return ""
+
+        # Walk forward to the last position that does not split an escape sequence
+        start = i = self._pos
+        end = len(self.text)
+        while i < end:
+            char = self.text[i]
+            if char == '"':
+                self.done = True
+                break
+            if char == "\\":
+                width = 6 if self.text[i + 1:i + 2] == "u" else 2
+                if i + width > end:
+                    break
+                i += width
+            else:
+                i += 1
+        self._pos = i
+        if i == start:
+            return ""
+        try:
+            return json.loads('"' + self.text[start:i] + '"')
+        except json.JSONDecodeError:
+            return ""
+
+def validate_steps(payload):
+    """Check a single-call payload against the step/content/final schema and return its steps, or None if invalid"""
+    if isinstance(payload, dict):
+        payload = payload.get("steps")
+    if not isinstance(payload, list) or not payload:
+        return None
     
-    if not client:
-        return [{
-            "step": "result", 
-            "content": "My arc reactor is offline! The genius needs an OpenAI API key to function. Check your environment variables, mortal.",
-            "final": True
-        }]
+    steps = []
+    for item in payload:
+        if not isinstance(item, dict):
+            return None
+        step, content, final = item.get("step"), item.get("content"), item.get("final", False)
+        if step not in STEP_ORDER or not isinstance(content, str) or not isinstance(final, bool):
+            return None
+        steps.append({"step": step, "content": content, "final": step == "result" or final})
+        if steps[-1]["final"]:
+            return steps
+    
+    # Never finished with a result step
+    return None
 
-    # Get or create conversation
-    if conversation_id not in conversations:
-        conversations[conversation_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
+def _generate_steps(temp_messages, steps, stream_tokens, mode, max_steps, deadline_at):
+    """Sub-pipeline that talks to the model: yields (and collects into `steps`) the intermediate steps, and returns (final_step, answer).
+
+    `answer` is the text to store in the conversation, or None when the final step is a fallback
+    rather than a real answer (nothing is stored or cached then). Each call gets whatever is left
+    of the deadline as its timeout; running out of calls or time ends with a synthesized result.
+    """
+    calls = 0
     
-    messages = conversations[conversation_id]
-    messages.append({"role": "user", "content": message})
+    def remaining():
+        return deadline_at - time.monotonic()
     
-    # Generate thinking steps
-    steps = []
+    if mode == "single":
+        try:
+            content = yield "call", dict(
+                model_router.request_kwargs("single"),
+                route="single",
+                messages=temp_messages + [{"role": "system", "content": SINGLE_CALL_PROMPT}],
+                response_format={"type": "json_object"},
+                timeout=max(0.1, min(UPSTREAM_TIMEOUT, remaining()))
+            )
+        except Exception:
+            if remaining() <= 0:
+                return synthesize_result(steps, "deadline"), None
+            raise
+        calls += 1
+        try:
+            with span("json_decode"):
+                parsed = validate_steps(json.loads(content))
+        except json.JSONDecodeError:
+            parsed = None
+        if parsed is None:
+            metrics.inc("stark_json_fallbacks_total", ("single",))
+        else:
+            for step_data in parsed[:-1]:
+                steps.append(step_data)
+                yield "step", step_data
+            return parsed[-1], parsed[-1]["content"]
+        # Malformed single-call output - fall back to the per-step loop
     
-    try:
-        # Keep generating until we get the final result
-        temp_messages = messages.copy()
-        
-        while True:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",  # Use original model
+    # Keep generating until we get the final result, or the budget runs out
+    while True:
+        if calls >= max_steps:
+            return synthesize_result(steps, "steps"), None
+        if remaining() <= 0:
+            return synthesize_result(steps, "deadline"), None
+        route = model_router.for_step(len(steps))
+        try:
+            content = yield ("stream" if stream_tokens else "call"), dict(
+                model_router.request_kwargs(route),
+                route=route,
                 messages=temp_messages,
                 response_format={"type": "json_object"},
-                temperature=0.8,
-                max_tokens=500
+                timeout=min(UPSTREAM_TIMEOUT, remaining())
             )
-            
-            # Parse the response
-            try:
-                step_data = json.loads(response.choices[0].message.content)
-                steps.append(step_data)
-                
-                # Add assistant's response to temporary messages
-                temp_messages.append({"role": "assistant", "content": response.choices[0].message.content})
-                
-                # If this is the final step, break
-                if step_data.get("step") == "result" or step_data.get("final", False):
-                    # Store the final response in conversation history
-                    final_content = step_data.get("content", "")
-                    conversations[conversation_id].append({"role": "assistant", "content": final_content})
-                    break
-                    
-                # Add user prompt to continue the thinking process
-                temp_messages.append({"role": "user", "content": "Continue to the next step."})
-                
-            except json.JSONDecodeError:
-                # Fallback response if JSON parsing fails
-                steps.append({
-                    "step": "result",
-                    "content": response.choices[0].message.content,
-                    "final": True
-                })
-                break
-                
+        except Exception:
+            # A call cut off by the request deadline still returns what we have so far
+            if remaining() <= 0:
+                return synthesize_result(steps, "deadline"), None
+            raise
+        calls += 1
+        
+        # Parse the response
+        try:
+            with span("json_decode"):
+                step_data = json.loads(content)
+        except json.JSONDecodeError:
+            step_data = None
+        if not isinstance(step_data, dict) or not isinstance(step_data.get("step", ""), str):
+            # Fallback response if the reply isn't JSON, or isn't shaped like a step
+            metrics.inc("stark_json_fallbacks_total", ("stepwise",))
+            return {
+                "step": "result",
+                "content": content,
+                "final": True
+            }, None
+        
+        # If this is the final step, hand it back so the response is stored in conversation history
+        if step_data.get("step") == "result" or step_data.get("final", False):
+            return step_data, step_data.get("content", "")
+        
+        steps.append(step_data)
+        yield "step", step_data
+        
+        # Add assistant's response and a prompt to continue the thinking process
+        temp_messages.append({"role": "assistant", "content": content})
+        temp_messages.append({"role": "user", "content": "Continue to the next step."})
+
+def stark_pipeline(message, conversation_id, stream_tokens=False, mode=None, max_steps=None, deadline=None):
+    """Generation logic without any network I/O, shared by the sync and async serving paths.
+
+    Yields ("step", step) and ("token", data) events for the client, and ("call", request_kwargs)
+    or ("stream", request_kwargs) when it needs a chat completion (PipelineRun takes the "route"
+    entry out of request_kwargs before the driver sees them). The driver performs the call
+    and sends back the response text, or throws the upstream error in. ("wait", (future, timeout))
+    means an identical request is already generating; the driver sends back the future's result,
+    or None if it doesn't arrive within the timeout.
+    """
+    mode = mode or GENERATION_MODE
+    max_steps = min(max_steps or MAX_STEPS, MAX_STEPS)
+    deadline_at = time.monotonic() + min(deadline or REQUEST_DEADLINE, REQUEST_DEADLINE)
+    
+    # Small talk is answered locally in microseconds; without a client, any reasonable match beats going offline
+    with span("intent_match"):
+        intent = intent_matcher.match(message) if INTENT_FAST_PATH else None
+        if intent is None and not get_client():
+            intent = intent_matcher.match(message, threshold=INTENT_DEGRADED_THRESHOLD)
+    if intent is not None:
+        steps = intent_steps(intent)
+        conversations.append(
+            conversation_id,
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": steps[-1]["content"]},
+            initial=[{"role": "system", "content": SYSTEM_PROMPT}]
+        )
+        for step_data in steps:
+            yield "step", step_data
+        return
+    
+    if not get_client():
+        yield "step", {
+            "step": "result", 
+            "content": "My arc reactor is offline! The genius needs an OpenAI API key to function. Check your environment variables, mortal.",
+            "final": True
+        }
+        return
+
+    # Get or create conversation and record the user's message
+    with span("history"):
+        history = conversations.append(
+            conversation_id,
+            {"role": "user", "content": message},
+            initial=[{"role": "system", "content": SYSTEM_PROMPT}]
+        )
+    
+    try:
+        # Only the system prompt, a rolling summary and the most recent turns that fit the budget are sent
+        temp_messages = yield from _build_context(conversation_id, history, deadline_at)
+        
+        # Identical question on identical context: reuse a cached answer or join the request already generating it
+        with span("cache_lookup"):
+            key = cache_key(message, temp_messages[:-1])
+            steps, leader = response_cache.get(key), False
+            # Context-free first turns can also reuse the answer to a differently worded question
+            context_free = len(history) == 2
+            if steps is None and context_free and semantic_cache is not None:
+                steps = semantic_cache.lookup(message)
+        if steps is None:
+            flight, leader = response_flights.begin(key)
+            if not leader:
+                steps = yield "wait", (flight, max(0.0, deadline_at - time.monotonic()))
+        if steps is not None:
+            conversations.append(conversation_id, {"role": "assistant", "content": steps[-1]["content"]})
+            for step_data in steps:
+                yield "step", step_data
+            return
+        
+        # Generate, then publish the answer to the cache and any requests waiting on this one
+        steps = []
+        try:
+            final_step, answer = yield from _generate_steps(temp_messages, steps, stream_tokens, mode, max_steps, deadline_at)
+            steps.append(final_step)
+            if answer is not None:
+                with span("store"):
+                    conversations.append(conversation_id, {"role": "assistant", "content": answer})
+                    response_cache.put(key, steps)
+                    if context_free and semantic_cache is not None:
+                        semantic_cache.put(message, steps)
+            if leader:
+                response_flights.end(key, steps if answer is not None else None)
+                leader = False
+            yield "step", final_step
+        finally:
+            if leader:
+                # Generation failed or was abandoned - waiting duplicates will generate for themselves
+                response_flights.end(key, None)
+        
     except Exception as e:
+        metrics.inc("stark_errors_total", ("generation",))
+        # Upstream is failing - fall back to a canned answer if the message is close enough to one
+        intent = intent_matcher.match(message, threshold=INTENT_DEGRADED_THRESHOLD)
+        if intent is not None:
+            steps = intent_steps(intent)
+            conversations.append(conversation_id, {"role": "assistant", "content": steps[-1]["content"]})
+            for step_data in steps:
+                yield "step", step_data
+            return
+        if isinstance(e, CircuitOpenError):
+            yield "step", {"step": "result", "content": BREAKER_MESSAGE, "final": True}
+            return
+        
         # Error handling with Stark-style response
-        steps.append({
+        yield "step", {
             "step": "result",
             "content": f"Even my genius has limits. Looks like something went wrong: {str(e)}. But don't worry, I'll fix it. I always do.",
             "final": True
-        })
+        }
+
+class PipelineRun:
+    """One request's pass through stark_pipeline, timed and counted the same way by both drivers.
+
+    Calls are timed from the moment the pipeline asks for a completion until the driver
+    comes back with the reply; steps from the previous step (or the start of the request).
+    The pipeline always runs under the request's trace, even on an executor thread.
+    """
+    
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.trace = current_trace()
+        self.started = self.last_step = time.perf_counter()
+        self.pending = None  # (kind, route, request kwargs, started) of the call in progress
+        self.steps = 0
+        metrics.inc("stark_requests_in_flight")
+    
+    def advance(self, reply=None, error=None, usage=None):
+        """Resume the pipeline with a completion's text (or an upstream error); returns the next event, or None when done"""
+        if self.pending is not None:
+            self._record_call(error, usage)
+        try:
+            with tracer.activate(self.trace):
+                event = self.pipeline.throw(error) if error is not None else self.pipeline.send(reply)
+        except StopIteration:
+            return None
+        now = time.perf_counter()
+        if event[0] == "step":
+            # The step name comes from the model, so only known steps become label values
+            step = event[1].get("step")
+            metrics.observe("stark_step_seconds", now - self.last_step, (step if step in STEP_ORDER else "other",))
+            self.last_step = now
+            self.steps += 1
+        elif event[0] in ("call", "stream"):
+            route = event[1].pop("route", "")
+            metrics.inc("stark_route_calls_total", (route, event[1].get("model", "")))
+            self.pending = (event[0], route, event[1], now)
+        return event
     
-    return steps
+    def close(self):
+        self.pipeline.close()
+        metrics.dec("stark_requests_in_flight")
+        metrics.observe("stark_request_seconds", time.perf_counter() - self.started)
+        metrics.observe("stark_steps_per_request", self.steps)
+    
+    def _record_call(self, error, usage):
+        kind, route, request_kwargs, started = self.pending
+        self.pending = None
+        model = request_kwargs.get("model", "")
+        duration = time.perf_counter() - started
+        metrics.observe("stark_upstream_seconds", duration, (model, kind))
+        metrics.observe("stark_route_seconds", duration, (route, model))
+        if self.trace is not None:
+            attrs = {"model": model, "route": route}
+            if error is not None:
+                attrs["error"] = type(error).__name__
+            if usage is not None:
+                attrs.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            self.trace.record(f"upstream_{kind}", started, duration, **attrs)
+        if error is not None:
+            metrics.inc("stark_upstream_errors_total", (model, type(error).__name__))
+        if usage is not None:
+            metrics.inc("stark_tokens_total", (model, "prompt"), usage.prompt_tokens or 0)
+            metrics.inc("stark_tokens_total", (model, "completion"), usage.completion_tokens or 0)
+            cost = model_router.cost(route, model, usage)
+            if cost is not None:
+                metrics.inc("stark_route_cost_usd_total", (route, model), cost)
+
+# Ask for token usage on the final chunk of streamed completions
+STREAM_OPTIONS = {"include_usage": True}
+
+def token_event(streamer, delta):
+    """Feed a streamed delta to the extractor; returns a ("token", data) event for result-step text, else None"""
+    text = streamer.feed(delta)
+    if text and streamer.step == "result":
+        return "token", {"step": streamer.step, "delta": text}
+    return None
+
+def _create_hedged(request_kwargs):
+    """client.chat.completions.create, plus a duplicate request if the first one runs slow"""
+    global _hedge_pool
+    create = get_client().chat.completions.create
+    delay = upstream.hedge_delay(request_kwargs)
+    if delay is None:
+        return create(**request_kwargs)
+    if _hedge_pool is None:
+        _hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("STARK_HEDGE_POOL_SIZE", 64)), thread_name_prefix="stark-hedge")
+    primary = _hedge_pool.submit(create, **request_kwargs)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    backup = _hedge_pool.submit(create, **request_kwargs)
+    error = None
+    for future in as_completed([primary, backup]):
+        try:
+            result = future.result()
+        except Exception as e:
+            error = e
+            continue
+        # The slower call keeps running in the pool; its answer is dropped
+        upstream.record_hedge(won=future is backup)
+        return result
+    upstream.record_hedge(won=False)
+    raise error
+
+def call_upstream(request_kwargs, stream=False):
+    """Chat completion through the retry / circuit breaker / hedging policy (streams are not hedged)"""
+    attempts = upstream.attempts(request_kwargs)
+    try:
+        kind, payload = next(attempts)
+        while True:
+            if kind == "sleep":
+                time.sleep(payload)
+                kind, payload = attempts.send(None)
+                continue
+            try:
+                if stream:
+                    result = get_client().chat.completions.create(stream=True, stream_options=STREAM_OPTIONS, **payload)
+                else:
+                    result = _create_hedged(payload)
+            except Exception as e:
+                kind, payload = attempts.send((None, e))
+            else:
+                kind, payload = attempts.send((result, None))
+    except StopIteration as done:
+        return done.value
+
+def iter_stark_steps(message, conversation_id, stream_tokens=False, mode=None, max_steps=None, deadline=None):
+    """Yield ("step", step) as each thinking step is parsed, plus ("token", data) for the result step if stream_tokens is set"""
+    run = PipelineRun(stark_pipeline(message, conversation_id, stream_tokens, mode, max_steps, deadline))
+    try:
+        event = run.advance()
+        while event is not None:
+            kind, payload = event
+            reply = error = usage = None
+            if kind == "call":
+                try:
+                    response = call_upstream(payload)
+                    reply, usage = response.choices[0].message.content, response.usage
+                except Exception as e:
+                    error = e
+            elif kind == "wait":
+                # An identical request is generating - share its answer
+                future, timeout = payload
+                try:
+                    reply = future.result(timeout=timeout)
+                except FutureTimeoutError:
+                    reply = None
+            elif kind == "stream":
+                streamer, parts = StepContentStreamer(), []
+                try:
+                    for chunk in call_upstream(payload, stream=True):
+                        usage = chunk.usage or usage
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        parts.append(delta)
+                        token = token_event(streamer, delta)
+                        if token:
+                            yield token
+                    reply = "".join(parts)
+                except Exception as e:
+                    error = e
+            else:
+                yield event
+            event = run.advance(reply, error, usage)
+    finally:
+        run.close()
+
+def generate_stark_response(message, conversation_id, mode=None, max_steps=None, deadline=None):
+    """Generate Tony Stark's response with thinking steps: the finished steps, result last (see stark_pipeline)"""
+    events = iter_stark_steps(message, conversation_id, mode=mode, max_steps=max_steps, deadline=deadline)
+    return [data for event, data in events if event == "step"]
+
+# Utility CSS for the page: the subset of Tailwind (v3 preflight and class names) that HTML_CONTENT uses,
+# precompiled instead of compiled in the browser by the Tailwind CDN runtime. Add a rule here when the page uses a new class.
+STYLESHEET = '''*, ::before, ::after { box-sizing: border-box; border: 0 solid #e5e7eb; }
+html { line-height: 1.5; -webkit-text-size-adjust: 100%; tab-size: 4; font-family: ui-sans-serif, system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; }
+body { margin: 0; line-height: inherit; }
+h1, h2, p, pre { margin: 0; }
+h1, h2 { font-size: inherit; font-weight: inherit; }
+pre, code { font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, monospace; font-size: 1em; }
+button, input { font-family: inherit; font-size: 100%; font-weight: inherit; line-height: inherit; color: inherit; margin: 0; padding: 0; }
+button { background-color: transparent; background-image: none; cursor: pointer; -webkit-appearance: button; }
+input::placeholder { opacity: 1; color: #9ca3af; }
+:disabled { cursor: default; }
+svg { display: block; vertical-align: middle; }
+[hidden] { display: none; }
+
+.absolute { position: absolute; }
+.relative { position: relative; }
+.inset-0 { top: 0; right: 0; bottom: 0; left: 0; }
+.-top-1 { top: -0.25rem; }
+.-right-1 { right: -0.25rem; }
+.z-10 { z-index: 10; }
+.mx-auto { margin-left: auto; margin-right: auto; }
+.my-2 { margin-top: 0.5rem; margin-bottom: 0.5rem; }
+.mb-1 { margin-bottom: 0.25rem; }
+.mb-2 { margin-bottom: 0.5rem; }
+.mb-4 { margin-bottom: 1rem; }
+.ml-1 { margin-left: 0.25rem; }
+.mt-10 { margin-top: 2.5rem; }
+.block { display: block; }
+.flex { display: flex; }
+.hidden { display: none; }
+.h-2 { height: 0.5rem; }
+.h-4 { height: 1rem; }
+.h-8 { height: 2rem; }
+.h-16 { height: 4rem; }
+.h-full { height: 100%; }
+.h-\\[calc\\(100vh-200px\\)\\] { height: calc(100vh - 200px); }
+.min-h-screen { min-height: 100vh; }
+.w-2 { width: 0.5rem; }
+.w-4 { width: 1rem; }
+.w-8 { width: 2rem; }
+.w-16 { width: 4rem; }
+.max-w-xs { max-width: 20rem; }
+.max-w-6xl { max-width: 72rem; }
+.flex-1 { flex: 1 1 0%; }
+.items-center { align-items: center; }
+.justify-start { justify-content: flex-start; }
+.justify-end { justify-content: flex-end; }
+.justify-between { justify-content: space-between; }
+.space-x-2 > :not([hidden]) ~ :not([hidden]) { margin-left: 0.5rem; }
+.space-y-3 > :not([hidden]) ~ :not([hidden]) { margin-top: 0.75rem; }
+.overflow-hidden { overflow: hidden; }
+.overflow-x-auto { overflow-x: auto; }
+.overflow-y-auto { overflow-y: auto; }
+.whitespace-pre-wrap { white-space: pre-wrap; }
+.break-words { overflow-wrap: break-word; }
+.rounded { border-radius: 0.25rem; }
+.rounded-lg { border-radius: 0.5rem; }
+.rounded-full { border-radius: 9999px; }
+.border { border-width: 1px; }
+.border-b { border-bottom-width: 1px; }
+.border-l-2 { border-left-width: 2px; }
+.border-gray-600 { border-color: #4b5563; }
+.border-red-500\\/30 { border-color: rgb(239 68 68 / 0.3); }
+.border-red-500\\/50 { border-color: rgb(239 68 68 / 0.5); }
+.border-blue-500\\/50 { border-color: rgb(59 130 246 / 0.5); }
+.border-yellow-400\\/30 { border-color: rgb(250 204 21 / 0.3); }
+.bg-black { background-color: #000; }
+.bg-black\\/60 { background-color: rgb(0 0 0 / 0.6); }
+.bg-black\\/80 { background-color: rgb(0 0 0 / 0.8); }
+.bg-transparent { background-color: transparent; }
+.bg-gray-800 { background-color: #1f2937; }
+.bg-gray-900 { background-color: #111827; }
+.bg-green-500 { background-color: #22c55e; }
+.bg-red-500\\/30 { background-color: rgb(239 68 68 / 0.3); }
+.bg-red-900\\/20 { background-color: rgb(127 29 29 / 0.2); }
+.bg-blue-600\\/20 { background-color: rgb(37 99 235 / 0.2); }
+.bg-gradient-to-r { background-image: linear-gradient(to right, var(--tw-gradient-stops)); }
+.bg-gradient-to-br { background-image: linear-gradient(to bottom right, var(--tw-gradient-stops)); }
+.from-red-500 { --tw-gradient-from: #ef4444; --tw-gradient-to: rgb(239 68 68 / 0); --tw-gradient-stops: var(--tw-gradient-from), var(--tw-gradient-to); }
+.from-red-600 { --tw-gradient-from: #dc2626; --tw-gradient-to: rgb(220 38 38 / 0); --tw-gradient-stops: var(--tw-gradient-from), var(--tw-gradient-to); }
+.from-red-900\\/20 { --tw-gradient-from: rgb(127 29 29 / 0.2); --tw-gradient-to: rgb(127 29 29 / 0); --tw-gradient-stops: var(--tw-gradient-from), var(--tw-gradient-to); }
+.via-black { --tw-gradient-to: rgb(0 0 0 / 0); --tw-gradient-stops: var(--tw-gradient-from), #000, var(--tw-gradient-to); }
+.to-red-700 { --tw-gradient-to: #b91c1c; }
+.to-yellow-500 { --tw-gradient-to: #eab308; }
+.to-yellow-900\\/20 { --tw-gradient-to: rgb(113 63 18 / 0.2); }
+.bg-clip-text { -webkit-background-clip: text; background-clip: text; }
+.p-2 { padding: 0.5rem; }
+.p-3 { padding: 0.75rem; }
+.p-4 { padding: 1rem; }
+.px-2 { padding-left: 0.5rem; padding-right: 0.5rem; }
+.px-3 { padding-left: 0.75rem; padding-right: 0.75rem; }
+.px-4 { padding-left: 1rem; padding-right: 1rem; }
+.py-1 { padding-top: 0.25rem; padding-bottom: 0.25rem; }
+.py-2 { padding-top: 0.5rem; padding-bottom: 0.5rem; }
+.py-3 { padding-top: 0.75rem; padding-bottom: 0.75rem; }
+.py-4 { padding-top: 1rem; padding-bottom: 1rem; }
+.pl-4 { padding-left: 1rem; }
+.text-center { text-align: center; }
+.text-xs { font-size: 0.75rem; line-height: 1rem; }
+.text-sm { font-size: 0.875rem; line-height: 1.25rem; }
+.text-xl { font-size: 1.25rem; line-height: 1.75rem; }
+.font-semibold { font-weight: 600; }
+.font-bold { font-weight: 700; }
+.italic { font-style: italic; }
+.text-white { color: #fff; }
+.text-transparent { color: transparent; }
+.text-gray-300 { color: #d1d5db; }
+.text-gray-400 { color: #9ca3af; }
+.text-green-400 { color: #4ade80; }
+.text-red-400 { color: #f87171; }
+.text-red-500 { color: #ef4444; }
+.text-red-500\\/50 { color: rgb(239 68 68 / 0.5); }
+.text-yellow-400 { color: #facc15; }
+.text-blue-100 { color: #dbeafe; }
+.placeholder-gray-500::placeholder { color: #6b7280; }
+.opacity-70 { opacity: 0.7; }
+.opacity-100 { opacity: 1; }
+.blur-sm { filter: blur(4px); }
+.backdrop-blur-md { -webkit-backdrop-filter: blur(12px); backdrop-filter: blur(12px); }
+.transition-all { transition-property: all; transition-timing-function: cubic-bezier(0.4, 0, 0.2, 1); transition-duration: 150ms; }
+.transition-colors { transition-property: color, background-color, border-color, fill, stroke; transition-timing-function: cubic-bezier(0.4, 0, 0.2, 1); transition-duration: 150ms; }
+.duration-200 { transition-duration: 200ms; }
+@keyframes pulse { 50% { opacity: 0.5; } }
+.animate-pulse { animation: pulse 2s cubic-bezier(0.4, 0, 0.6, 1) infinite; }
+
+.hover\\:scale-105:hover { transform: scale(1.05); }
+.hover\\:from-red-700:hover { --tw-gradient-from: #b91c1c; --tw-gradient-to: rgb(185 28 28 / 0); --tw-gradient-stops: var(--tw-gradient-from), var(--tw-gradient-to); }
+.hover\\:to-red-800:hover { --tw-gradient-to: #991b1b; }
+.focus\\:border-red-500:focus { border-color: #ef4444; }
+.focus\\:outline-none:focus { outline: 2px solid transparent; outline-offset: 2px; }
+.disabled\\:cursor-not-allowed:disabled { cursor: not-allowed; }
+.disabled\\:opacity-50:disabled { opacity: 0.5; }
+
+@media (min-width: 640px) {
+    .sm\\:mt-20 { margin-top: 5rem; }
+    .sm\\:block { display: block; }
+    .sm\\:h-5 { height: 1.25rem; }
+    .sm\\:h-10 { height: 2.5rem; }
+    .sm\\:h-20 { height: 5rem; }
+    .sm\\:w-5 { width: 1.25rem; }
+    .sm\\:w-10 { width: 2.5rem; }
+    .sm\\:w-20 { width: 5rem; }
+    .sm\\:max-w-2xl { max-width: 42rem; }
+    .sm\\:space-x-3 > :not([hidden]) ~ :not([hidden]) { margin-left: 0.75rem; }
+    .sm\\:space-y-4 > :not([hidden]) ~ :not([hidden]) { margin-top: 1rem; }
+    .sm\\:p-3 { padding: 0.75rem; }
+    .sm\\:p-4 { padding: 1rem; }
+    .sm\\:p-6 { padding: 1.5rem; }
+    .sm\\:px-4 { padding-left: 1rem; padding-right: 1rem; }
+    .sm\\:py-3 { padding-top: 0.75rem; padding-bottom: 0.75rem; }
+    .sm\\:py-4 { padding-top: 1rem; padding-bottom: 1rem; }
+    .sm\\:py-6 { padding-top: 1.5rem; padding-bottom: 1.5rem; }
+    .sm\\:text-sm { font-size: 0.875rem; line-height: 1.25rem; }
+    .sm\\:text-base { font-size: 1rem; line-height: 1.5rem; }
+    .sm\\:text-2xl { font-size: 1.5rem; line-height: 2rem; }
+}
+'''
 
 # HTML content served directly (Vercel-friendly) - ORIGINAL CODE WITH MINIMAL MOBILE FIXES
 HTML_CONTENT = '''<!DOCTYPE html>
@@ -161,8 +991,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>STARK AI - Tony Stark Chatbot</title>
-    <script src="https://unpkg.com/lucide@latest/dist/umd/lucide.js"></script>
-    <script src="https://cdn.tailwindcss.com"></script>
+    <link rel="stylesheet" href="{{STYLESHEET_URL}}">
     <style>
         @keyframes float {
             0%, 100% { transform: translateY(0px); }
@@ -182,6 +1011,10 @@ HTML_CONTENT = '''<!DOCTYPE html>
         .scrollbar-thumb-red-500::-webkit-scrollbar-thumb { background-color: rgba(239, 68, 68, 0.5); border-radius: 3px; }
         .scrollbar-track-black::-webkit-scrollbar-track { background-color: rgba(0, 0, 0, 0.5); }
         .particle { animation: float var(--duration) ease-in-out infinite; }
+        #particles.paused .particle { animation-play-state: paused; }
+        @media (prefers-reduced-motion: reduce) {
+            .particle, .animate-pulse, .animate-fadeIn, .animate-slideIn { animation: none; }
+        }
         .thinking-dots { display: inline-flex; }
         .thinking-dots .dot { animation: thinking 1.4s infinite; animation-fill-mode: both; color: #fbbf24; }
         .thinking-dots .dot:nth-child(1) { animation-delay: 0s; }
@@ -222,8 +1055,8 @@ HTML_CONTENT = '''<!DOCTYPE html>
         <div class="max-w-6xl mx-auto px-2 sm:px-4 py-3 sm:py-4 flex items-center justify-between">
             <div class="flex items-center space-x-2 sm:space-x-3">
                 <div class="relative">
-                    <i data-lucide="shield" class="w-8 h-8 sm:w-10 sm:h-10 text-red-500"></i>
-                    <i data-lucide="zap" class="w-4 h-4 sm:w-5 sm:h-5 text-yellow-400 absolute -top-1 -right-1 animate-pulse"></i>
+                    <i data-icon="shield" class="w-8 h-8 sm:w-10 sm:h-10 text-red-500"></i>
+                    <i data-icon="zap" class="w-4 h-4 sm:w-5 sm:h-5 text-yellow-400 absolute -top-1 -right-1 animate-pulse"></i>
                 </div>
                 <div>
                     <h1 class="text-xl sm:text-2xl font-bold bg-gradient-to-r from-red-500 to-yellow-500 bg-clip-text text-transparent">STARK AI</h1>
@@ -240,7 +1073,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
         <div class="bg-black/60 backdrop-blur-md rounded-lg border border-red-500/30 h-full overflow-hidden">
             <div id="chatMessages" class="h-full overflow-y-auto p-3 sm:p-6 space-y-3 sm:space-y-4 scrollbar-thin scrollbar-thumb-red-500 scrollbar-track-black">
                 <div id="welcomeMessage" class="text-center mt-10 sm:mt-20">
-                    <i data-lucide="brain" class="w-16 h-16 sm:w-20 sm:h-20 mx-auto text-red-500/50 mb-4"></i>
+                    <i data-icon="brain" class="w-16 h-16 sm:w-20 sm:h-20 mx-auto text-red-500/50 mb-4"></i>
                     <h2 class="text-xl sm:text-2xl font-bold mb-2">Welcome to STARK AI</h2>
                     <p class="text-gray-400 px-4">Ask me anything. I'll try not to be too condescending.</p>
                 </div>
@@ -252,23 +1085,59 @@ HTML_CONTENT = '''<!DOCTYPE html>
             <div class="flex items-center space-x-2 sm:space-x-3">
                 <input type="text" id="messageInput" placeholder="Ask the genius anything..." class="flex-1 bg-transparent border border-red-500/30 rounded-lg px-3 sm:px-4 py-2 sm:py-3 text-white placeholder-gray-500 focus:outline-none focus:border-red-500 transition-colors text-sm sm:text-base" />
                 <button id="sendButton" class="bg-gradient-to-r from-red-600 to-red-700 hover:from-red-700 hover:to-red-800 disabled:opacity-50 disabled:cursor-not-allowed rounded-lg p-2 sm:p-3 transition-all duration-200 transform hover:scale-105">
-                    <i data-lucide="send" class="w-4 h-4 sm:w-5 sm:h-5"></i>
+                    <i data-icon="send" class="w-4 h-4 sm:w-5 sm:h-5"></i>
                 </button>
             </div>
         </div>
     </div>
     <script>
-        lucide.createIcons();
+        // Inline SVG icons (lucide/feather outlines), so the page needs no icon library
+        const ICONS = {
+            shield: '<path d="M12 22s8-4 8-10V5l-8-3-8 3v7c0 6 8 10 8 10z"/>',
+            zap: '<polygon points="13 2 3 14 12 14 11 22 21 10 12 10 13 2"/>',
+            brain: '<path d="M9.5 2A2.5 2.5 0 0 1 12 4.5v15a2.5 2.5 0 0 1-4.96.44 2.5 2.5 0 0 1-2.96-3.08 3 3 0 0 1-.34-5.58 2.5 2.5 0 0 1 1.32-4.24 2.5 2.5 0 0 1 1.98-3A2.5 2.5 0 0 1 9.5 2Z"/><path d="M14.5 2A2.5 2.5 0 0 0 12 4.5v15a2.5 2.5 0 0 0 4.96.44 2.5 2.5 0 0 0 2.96-3.08 3 3 0 0 0 .34-5.58 2.5 2.5 0 0 0-1.32-4.24 2.5 2.5 0 0 0-1.98-3A2.5 2.5 0 0 0 14.5 2Z"/>',
+            send: '<line x1="22" y1="2" x2="11" y2="13"/><polygon points="22 2 15 22 11 13 2 9 22 2"/>',
+            cpu: '<rect x="4" y="4" width="16" height="16" rx="2"/><rect x="9" y="9" width="6" height="6"/><path d="M9 1v3M15 1v3M9 20v3M15 20v3M20 9h3M20 14h3M1 9h3M1 14h3"/>'
+        };
+
+        // Icons are created per new element, never by rescanning the whole document
+        function createIcons(root = document) {
+            root.querySelectorAll('i[data-icon]').forEach(el => {
+                el.outerHTML = `<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round" class="${el.getAttribute('class') || ''}" aria-hidden="true">${ICONS[el.dataset.icon] || ''}</svg>`;
+            });
+        }
+
+        createIcons();
         let conversationId = null;
         let isThinking = false;
         const chatMessages = document.getElementById('chatMessages');
         const messageInput = document.getElementById('messageInput');
         const sendButton = document.getElementById('sendButton');
         const welcomeMessage = document.getElementById('welcomeMessage');
+        const STEP_NAMES = {
+            'analyze': '🔍 ANALYZING',
+            'think': '🧠 THINKING', 
+            'validate': '✅ VALIDATING',
+            'output': '⚡ OUTPUTTING',
+            'result': '🎯 RESULT'
+        };
+        const THINKING_DOTS = '<div class="thinking-dots ml-1"><span class="dot">.</span><span class="dot">.</span><span class="dot">.</span></div>';
+        // Very long chats keep only the newest messages in the DOM
+        const MAX_RENDERED_MESSAGES = 200;
+        const reducedMotion = window.matchMedia('(prefers-reduced-motion: reduce)');
+        // The non-streaming fallback replays steps with pauses between them; ?replay=0 or reduced motion skips them
+        const REPLAY_DELAYS = !reducedMotion.matches && new URLSearchParams(location.search).get('replay') !== '0';
+        // Decided before sending: once the stream endpoint has accepted a message it is already generating
+        const CAN_STREAM = Boolean(window.ReadableStream && window.TextDecoder && window.Response && 'body' in Response.prototype);
 
         function initParticles() {
             const particlesContainer = document.getElementById('particles');
-            for (let i = 0; i < 50; i++) {
+            // Blurred, animated particles are costly: fewer (and static, via CSS) with reduced motion, paused while hidden
+            const count = reducedMotion.matches ? 12 : 50;
+            document.addEventListener('visibilitychange', () => {
+                particlesContainer.classList.toggle('paused', document.hidden);
+            });
+            for (let i = 0; i < count; i++) {
                 const particle = document.createElement('div');
                 particle.className = 'absolute rounded-full bg-red-500/30 blur-sm animate-pulse particle';
                 particle.style.left = Math.random() * 100 + '%';
@@ -280,8 +1149,22 @@ HTML_CONTENT = '''<!DOCTYPE html>
             }
         }
 
+        let scrollPending = false;
         function scrollToBottom() {
-            chatMessages.scrollTop = chatMessages.scrollHeight;
+            // At most one layout per frame, however fast tokens arrive
+            if (scrollPending) return;
+            scrollPending = true;
+            requestAnimationFrame(() => {
+                scrollPending = false;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            });
+        }
+
+        function appendMessage(messageDiv) {
+            chatMessages.appendChild(messageDiv);
+            while (chatMessages.childElementCount > MAX_RENDERED_MESSAGES + 1) {
+                chatMessages.removeChild(welcomeMessage.nextElementSibling);
+            }
         }
 
         function addMessage(role, content, isTyping = false) {
@@ -294,7 +1177,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
             if (role === 'assistant') {
                 const header = document.createElement('div');
                 header.className = 'flex items-center space-x-2 mb-1';
-                header.innerHTML = `<i data-lucide="cpu" class="w-4 h-4 text-red-400"></i><span class="text-xs text-red-400 font-semibold">STARK AI</span>`;
+                header.innerHTML = `<i data-icon="cpu" class="w-4 h-4 text-red-400"></i><span class="text-xs text-red-400 font-semibold">STARK AI</span>`;
                 contentDiv.appendChild(header);
             }
 
@@ -307,8 +1190,8 @@ HTML_CONTENT = '''<!DOCTYPE html>
             }
             contentDiv.appendChild(textDiv);
             messageDiv.appendChild(contentDiv);
-            chatMessages.appendChild(messageDiv);
-            lucide.createIcons();
+            createIcons(messageDiv);
+            appendMessage(messageDiv);
             scrollToBottom();
             return textDiv;
         }
@@ -339,23 +1222,31 @@ HTML_CONTENT = '''<!DOCTYPE html>
             const thinkingElement = addThinkingLoader();
             
             try {
-                const response = await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ message: message, conversation_id: conversationId })
-                });
-                
-                const data = await response.json();
-                
-                if (response.ok) {
-                    conversationId = data.conversation_id;
-                    const steps = data.steps;
+                if (CAN_STREAM) {
+                    const response = await fetch('/api/chat/stream', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ message: message, conversation_id: conversationId, stream_tokens: true })
+                    });
                     
-                    // Show thinking steps in real-time
-                    await showThinkingSteps(thinkingElement, steps);
+                    if (!response.ok) {
+                        const data = await response.json();
+                        throw new Error(data.error || 'Something went wrong');
+                    }
                     
+                    // Render each thinking step the moment the server sends it
+                    await streamThinkingSteps(thinkingElement, response.body.getReader());
                 } else {
-                    throw new Error(data.error || 'Something went wrong');
+                    // No streaming support - use the blocking endpoint and replay the steps
+                    const response = await fetch('/api/chat', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ message: message, conversation_id: conversationId })
+                    });
+                    const data = await response.json();
+                    if (!response.ok) throw new Error(data.error || 'Something went wrong');
+                    conversationId = data.conversation_id;
+                    await showThinkingSteps(thinkingElement, data.steps);
                 }
             } catch (error) {
                 removeThinkingLoader(thinkingElement);
@@ -366,21 +1257,81 @@ HTML_CONTENT = '''<!DOCTYPE html>
             }
         }
 
-        async function showThinkingSteps(thinkingElement, steps) {
-            const stepNames = {
-                'analyze': '🔍 ANALYZING',
-                'think': '🧠 THINKING', 
-                'validate': '✅ VALIDATING',
-                'output': '⚡ OUTPUTTING',
-                'result': '🎯 RESULT'
+        async function streamThinkingSteps(thinkingElement, reader) {
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let accumulatedSteps = [];
+            let liveText = null;
+            let finished = false;
+            
+            const handleEvent = (event, data) => {
+                if (event === 'meta') {
+                    conversationId = data.conversation_id;
+                } else if (event === 'token') {
+                    // Token-level streaming of the final answer
+                    if (data.step !== 'result') return;
+                    if (!liveText) {
+                        removeThinkingLoader(thinkingElement);
+                        liveText = addMessage('assistant', '');
+                    }
+                    liveText.textContent += data.delta;
+                    scrollToBottom();
+                } else if (event === 'step') {
+                    const stepName = STEP_NAMES[data.step] || String(data.step).toUpperCase();
+                    if (data.step !== 'result' && !data.final) {
+                        accumulatedSteps.push({ name: stepName, content: data.content });
+                        updateThinkingStepsAccumulated(thinkingElement, accumulatedSteps);
+                        return;
+                    }
+                    removeThinkingLoader(thinkingElement);
+                    if (liveText) {
+                        if (data.content.includes('```')) {
+                            liveText.innerHTML = formatCodeBlocks(data.content);
+                        } else {
+                            liveText.textContent = data.content;
+                        }
+                        scrollToBottom();
+                    } else {
+                        addMessage('assistant', data.content);
+                    }
+                    finished = true;
+                } else if (event === 'error') {
+                    throw new Error(data.error || 'Something went wrong');
+                }
             };
             
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let event = 'message';
+                    let dataLines = [];
+                    rawEvent.split('\\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                    });
+                    if (dataLines.length) handleEvent(event, JSON.parse(dataLines.join('\\n')));
+                }
+            }
+            
+            if (!finished) throw new Error('The stream ended before the final answer arrived');
+            isThinking = false;
+            sendButton.disabled = false;
+            messageInput.disabled = false;
+            messageInput.focus();
+        }
+
+        async function showThinkingSteps(thinkingElement, steps) {
             let accumulatedSteps = [];
             
             // Show each thinking step accumulating
             for (let i = 0; i < steps.length; i++) {
                 const step = steps[i];
-                const stepName = stepNames[step.step] || step.step.toUpperCase();
+                const stepName = STEP_NAMES[step.step] || step.step.toUpperCase();
                 
                 if (step.step !== 'result') {
                     // Add this step to accumulated steps
@@ -391,7 +1342,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
                     
                     // Update thinking loader with all accumulated steps
                     updateThinkingStepsAccumulated(thinkingElement, accumulatedSteps);
-                    await new Promise(resolve => setTimeout(resolve, 800)); // Show each step for 800ms
+                    if (REPLAY_DELAYS) await new Promise(resolve => setTimeout(resolve, 800)); // Show each step for 800ms
                 } else {
                     // Final result - add to accumulated and then show final response
                     accumulatedSteps.push({
@@ -401,7 +1352,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
                     updateThinkingStepsAccumulated(thinkingElement, accumulatedSteps);
                     
                     // Wait a moment to show the complete thought process
-                    await new Promise(resolve => setTimeout(resolve, 1200));
+                    if (REPLAY_DELAYS) await new Promise(resolve => setTimeout(resolve, 1200));
                     
                     // Remove thinking loader and show final response
                     removeThinkingLoader(thinkingElement);
@@ -416,29 +1367,39 @@ HTML_CONTENT = '''<!DOCTYPE html>
 
         function updateThinkingStepsAccumulated(thinkingElement, accumulatedSteps) {
             const thinkingDiv = thinkingElement.querySelector('.thinking-content');
-            if (thinkingDiv) {
-                let stepsHtml = '';
-                
-                accumulatedSteps.forEach((step, index) => {
-                    const isLatest = index === accumulatedSteps.length - 1;
-                    const opacity = isLatest ? 'opacity-100' : 'opacity-70';
-                    const truncatedContent = step.content.length > 120 ? 
-                        step.content.substring(0, 120) + '...' : step.content;
-                    
-                    stepsHtml += `
-                        <div class="mb-2 ${opacity} ${isLatest ? 'animate-fadeIn' : ''}">
-                            <div class="flex items-center space-x-2 mb-1">
-                                <span class="text-yellow-400 font-semibold text-xs">${step.name}</span>
-                                ${isLatest ? '<div class="thinking-dots ml-1"><span class="dot">.</span><span class="dot">.</span><span class="dot">.</span></div>' : ''}
-                            </div>
-                            <div class="text-gray-300 text-xs italic pl-4 border-l-2 border-yellow-400/30">${truncatedContent}</div>
-                        </div>
-                    `;
-                });
-                
-                thinkingDiv.innerHTML = stepsHtml;
-                scrollToBottom();
+            if (!thinkingDiv) return;
+            const rendered = thinkingDiv.querySelectorAll('.thinking-step');
+            if (rendered.length === accumulatedSteps.length) return;
+            
+            // Only the new steps are built; the previous latest step just loses its highlight
+            if (rendered.length === 0) {
+                thinkingDiv.textContent = '';  // Drop the "Initializing" placeholder
+            } else {
+                const previous = rendered[rendered.length - 1];
+                previous.classList.remove('opacity-100', 'animate-fadeIn');
+                previous.classList.add('opacity-70');
+                const dots = previous.querySelector('.thinking-dots');
+                if (dots) dots.remove();
+            }
+            for (let index = rendered.length; index < accumulatedSteps.length; index++) {
+                thinkingDiv.appendChild(renderThinkingStep(accumulatedSteps[index], index === accumulatedSteps.length - 1));
             }
+            scrollToBottom();
+        }
+
+        function renderThinkingStep(step, isLatest) {
+            const stepDiv = document.createElement('div');
+            stepDiv.className = `thinking-step mb-2 ${isLatest ? 'opacity-100 animate-fadeIn' : 'opacity-70'}`;
+            const label = document.createElement('div');
+            label.className = 'flex items-center space-x-2 mb-1';
+            label.innerHTML = `<span class="text-yellow-400 font-semibold text-xs"></span>${isLatest ? THINKING_DOTS : ''}`;
+            label.firstChild.textContent = step.name;
+            const text = document.createElement('div');
+            text.className = 'text-gray-300 text-xs italic pl-4 border-l-2 border-yellow-400/30';
+            text.textContent = step.content.length > 120 ? step.content.substring(0, 120) + '...' : step.content;
+            stepDiv.appendChild(label);
+            stepDiv.appendChild(text);
+            return stepDiv;
         }
 
         function addThinkingLoader() {
@@ -450,22 +1411,22 @@ HTML_CONTENT = '''<!DOCTYPE html>
             contentDiv.className = 'max-w-xs sm:max-w-2xl px-3 sm:px-4 py-2 sm:py-3 rounded-lg bg-red-900/20 border border-red-500/50';
             const header = document.createElement('div');
             header.className = 'flex items-center space-x-2 mb-2';
-            header.innerHTML = `<i data-lucide="cpu" class="w-4 h-4 text-red-400"></i><span class="text-xs text-red-400 font-semibold">STARK AI</span>`;
+            header.innerHTML = `<i data-icon="cpu" class="w-4 h-4 text-red-400"></i><span class="text-xs text-red-400 font-semibold">STARK AI</span>`;
             contentDiv.appendChild(header);
             
             const thinkingDiv = document.createElement('div');
             thinkingDiv.className = 'thinking-content';
             thinkingDiv.innerHTML = `
                 <div class="flex items-center space-x-2">
-                    <i data-lucide="brain" class="w-4 h-4 text-yellow-400 animate-pulse"></i>
+                    <i data-icon="brain" class="w-4 h-4 text-yellow-400 animate-pulse"></i>
                     <span class="thinking-text text-sm">Initializing genius-level processing</span>
                     <div class="thinking-dots"><span class="dot">.</span><span class="dot">.</span><span class="dot">.</span></div>
                 </div>
             `;
             contentDiv.appendChild(thinkingDiv);
             messageDiv.appendChild(contentDiv);
-            chatMessages.appendChild(messageDiv);
-            lucide.createIcons();
+            createIcons(messageDiv);
+            appendMessage(messageDiv);
             scrollToBottom();
             return messageDiv;
         }
@@ -490,47 +1451,372 @@ HTML_CONTENT = '''<!DOCTYPE html>
 </body>
 </html>'''
 
+# The stylesheet URL carries a hash of its content, so browsers can cache it for good; the page
+# itself is revalidated with its ETag. Both are compressed once (here, or on first request with LAZY_INIT).
+stylesheet_asset = StaticAsset(STYLESHEET, "text/css; charset=utf-8", cache_control=IMMUTABLE, lazy=LAZY_INIT)
+STYLESHEET_URL = f"/assets/stark.{stylesheet_asset.version}.css"
+page_asset = StaticAsset(HTML_CONTENT.replace("{{STYLESHEET_URL}}", STYLESHEET_URL), "text/html; charset=utf-8", lazy=LAZY_INIT)
+
+def parse_chat_request(data):
+    """Validate a chat request body; returns (options, error message)"""
+    data = data or {}
+    message = data.get('message', '')
+    mode = data.get('mode')
+    max_steps = data.get('max_steps')
+    deadline = data.get('deadline')
+    stream_tokens = data.get('stream_tokens')
+    
+    if not message:
+        return None, "Message is required"
+    if not isinstance(message, str):
+        return None, "message must be a string"
+    if data.get('conversation_id') is not None and not isinstance(data['conversation_id'], str):
+        return None, "conversation_id must be a string"
+    if mode is not None and mode not in GENERATION_MODES:
+        return None, f"mode must be one of {', '.join(GENERATION_MODES)}"
+    if max_steps is not None and (not isinstance(max_steps, int) or isinstance(max_steps, bool) or max_steps < 1):
+        return None, "max_steps must be a positive integer"
+    if deadline is not None and (not isinstance(deadline, (int, float)) or isinstance(deadline, bool) or deadline <= 0):
+        return None, "deadline must be a positive number of seconds"
+    if stream_tokens is not None and not isinstance(stream_tokens, bool):
+        return None, "stream_tokens must be true or false"
+    
+    return {
+        "message": message,
+        "conversation_id": data.get('conversation_id') or f"conv_{os.urandom(8).hex()}",
+        "mode": mode,
+        "stream_tokens": bool(stream_tokens),
+        "max_steps": max_steps,
+        "deadline": deadline
+    }, None
+
+def _wait_for(future, timeout):
+    """Wait for a WaitQueue grant; False if it didn't come in time"""
+    try:
+        future.result(timeout=timeout)
+        return True
+    except FutureTimeoutError:
+        return not WaitQueue.give_up(future)
+
+def admit(client_address, conversation_id):
+    """Rate-limit the client, then enter() the conversation; raises Rejected. Pair with leave()"""
+    admission.check_rate(client_address)
+    enter(conversation_id)
+
+def enter(conversation_id):
+    """Take the conversation's lock and a generation slot, waiting if needed; raises Rejected"""
+    if not _wait_for(admission.conversation_lock(conversation_id), admission.conversation_timeout):
+        raise admission.conversation_busy()
+    try:
+        if not _sleep_through(admission.process_lock(conversation_id)):
+            raise admission.conversation_busy()
+        if not _wait_for(admission.slot(), admission.wait_timeout):
+            raise admission.overloaded()
+    except Rejected:
+        admission.release_conversation(conversation_id)
+        raise
+
+def _sleep_through(waits):
+    """Drive a sans-IO wait that yields seconds to sleep; returns its result"""
+    try:
+        while True:
+            time.sleep(next(waits))
+    except StopIteration as done:
+        return done.value
+
+def leave(conversation_id):
+    admission.slots.release()
+    admission.release_conversation(conversation_id)
+
+def forwarded_client(forwarded_for, remote_addr):
+    """Client address for rate limiting: the X-Forwarded-For entry added by our outermost trusted proxy.
+
+    Entries further left come from the client, which can put anything there, so only
+    the TRUST_PROXY-th entry from the right is used.
+    """
+    if TRUST_PROXY and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        if len(hops) >= TRUST_PROXY and hops[-TRUST_PROXY]:
+            return hops[-TRUST_PROXY]
+    return remote_addr
+
+def client_address():
+    return forwarded_client(request.headers.get('X-Forwarded-For'), request.remote_addr)
+
+def rejection_response(rejected):
+    response = jsonify({"error": rejected.message})
+    if rejected.retry_after is not None:
+        response.headers["Retry-After"] = str(math.ceil(rejected.retry_after))
+    return response, rejected.status
+
+# Batch endpoint: items fan out over one shared, bounded worker pool
+BATCH_WORKERS = int(os.getenv("STARK_BATCH_WORKERS", 16))
+BATCH_MAX_ITEMS = int(os.getenv("STARK_BATCH_MAX_ITEMS", 100))
+_batch_pool = None
+
+def parse_batch_request(data):
+    """Validate a batch request body; returns (groups, concurrency, error message).
+
+    Each item is checked on its own, so a bad item becomes an error line rather than failing
+    the batch. Items are grouped by conversation: a group runs in order, groups run concurrently.
+    Each group is a list of (index, options, error).
+    """
+    data = data or {}
+    items = data.get('items')
+    concurrency = data.get('concurrency', BATCH_WORKERS)
+    
+    if not isinstance(items, list) or not items:
+        return None, None, "items must be a non-empty list"
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, None, f"A batch holds at most {BATCH_MAX_ITEMS} items"
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        return None, None, "concurrency must be a positive integer"
+    
+    groups = {}
+    for index, item in enumerate(items):
+        options, error = parse_chat_request(item if isinstance(item, dict) else None)
+        if options is not None:
+            options.pop("stream_tokens")
+        key = options["conversation_id"] if options is not None else f"invalid_{index}"
+        groups.setdefault(key, []).append((index, options, error))
+    return list(groups.values()), min(concurrency, BATCH_WORKERS), None
+
+def run_batch_item(index, options, error):
+    """Generate one batch item; returns its NDJSON record"""
+    if error:
+        return {"index": index, "error": error, "status": 400}
+    conversation_id = options["conversation_id"]
+    try:
+        enter(conversation_id)
+    except Rejected as e:
+        return {"index": index, "conversation_id": conversation_id, "error": e.message, "status": e.status}
+    try:
+        return {"index": index, "conversation_id": conversation_id, "steps": generate_stark_response(**options)}
+    except Exception as e:
+        metrics.inc("stark_errors_total", ("request",))
+        return {"index": index, "conversation_id": conversation_id, "error": str(e), "status": 500}
+    finally:
+        leave(conversation_id)
+
+def iter_batch(groups, concurrency):
+    """Run batch items on the shared pool, yielding each record as soon as its item completes"""
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="stark-batch")
+    results = queue.Queue()
+    pending = iter(groups)
+    pending_lock = threading.Lock()
+    cancelled = threading.Event()
+    
+    def worker():
+        while True:
+            with pending_lock:
+                group = next(pending, None)
+            if group is None:
+                return
+            for item in group:
+                if cancelled.is_set():
+                    return
+                results.put(run_batch_item(*item))
+    
+    for _ in range(min(concurrency, len(groups))):
+        _batch_pool.submit(worker)
+    try:
+        for _ in range(sum(len(group) for group in groups)):
+            yield results.get()
+    finally:
+        # Client went away - don't start items nobody will read
+        cancelled.set()
+
+def begin_trace(name, headers):
+    """Start a trace for a request if it is sampled, or asks to be profiled (when profiling is enabled)"""
+    return tracer.begin(name, profile=PROFILING_ENABLED and headers.get("X-Stark-Profile") == "1")
+
+def health_status():
+    """Payload for the health check endpoint"""
+    return {
+        "status": "online",
+        "message": "Arc Reactor at full capacity. STARK AI operational.",
+        "conversations": conversations.stats(),
+        "snapshot": snapshotter.stats() if snapshotter is not None else None,
+        "response_cache": dict(response_cache.stats(), coalesced=response_flights.coalesced),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "upstream": upstream.stats(),
+        "admission": admission.stats(),
+        "model_routes": model_router.models(),
+        "generation": {
+            "budget_exhausted": metrics.value("stark_truncated_total", ("steps",)),
+            "deadline_exceeded": metrics.value("stark_truncated_total", ("deadline",))
+        }
+    }
+
+# Values owned by other components, read when /api/metrics is scraped
+metrics.sample("stark_conversations", "gauge", "Conversations held in the store", lambda: conversations.stats()["conversations"])
+metrics.sample("stark_conversation_bytes", "gauge", "Approximate size of stored conversation history", lambda: conversations.stats()["bytes"])
+if snapshotter is not None:
+    metrics.sample("stark_snapshots_total", "counter", "Conversation store snapshots written", lambda: snapshotter.snapshots)
+    metrics.sample("stark_snapshot_failures_total", "counter", "Conversation store snapshots that failed", lambda: snapshotter.failures)
+    metrics.sample("stark_snapshot_bytes", "gauge", "Size of the latest conversation store snapshot", lambda: snapshotter.last_bytes)
+    metrics.sample("stark_snapshot_seconds", "gauge", "How long the latest snapshot took to write", lambda: snapshotter.last_seconds)
+    metrics.sample("stark_snapshot_restore_seconds", "gauge", "How long restoring the snapshot took at startup", lambda: snapshotter.restore_seconds)
+metrics.sample("stark_response_cache_hits_total", "counter", "Exact-match response cache hits", lambda: response_cache.hits)
+metrics.sample("stark_response_cache_misses_total", "counter", "Exact-match response cache misses", lambda: response_cache.misses)
+metrics.sample("stark_upstream_retries_total", "counter", "OpenAI calls retried after a transient error", lambda: upstream.retries)
+metrics.sample("stark_upstream_hedges_total", "counter", "Duplicate OpenAI calls sent for slow requests", lambda: upstream.hedges)
+metrics.sample("stark_upstream_hedge_wins_total", "counter", "Hedged calls where the duplicate answered first", lambda: upstream.hedge_wins)
+metrics.sample("stark_breaker_open", "gauge", "1 while the upstream circuit breaker is open or half-open", lambda: int(upstream.breaker.state != CircuitBreaker.CLOSED))
+metrics.sample("stark_breaker_rejected_total", "counter", "Calls answered locally because the breaker was open", lambda: upstream.breaker.rejected)
+metrics.sample("stark_generations_active", "gauge", "Generations holding an admission slot", lambda: admission.slots.active)
+metrics.sample("stark_generations_waiting", "gauge", "Requests queued for an admission slot", lambda: admission.slots.waiting)
+metrics.sample("stark_rejected_total", "counter", "Requests turned away by admission control", lambda: admission.rejected, labels=("reason",))
+metrics.sample("stark_coalesced_requests_total", "counter", "Duplicate requests that shared one generation", lambda: response_flights.coalesced)
+
+# Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def reset_conversation_state(conversation_id):
+    """Forget a conversation's history and cached summary"""
+    conversations.delete(conversation_id)
+    context_window.forget(conversation_id)
+    if snapshotter is not None:
+        # Don't leave the reset conversation in the snapshot until the next interval
+        snapshotter.request()
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def asset_response(asset):
+    """Serve a precompressed asset in the encoding the client prefers, or a 304 if its copy is current"""
+    status, headers, body = asset.respond(request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
 @app.route('/')
 def index():
     """Serve the main page directly"""
-    from flask import Response
-    return Response(HTML_CONTENT, mimetype='text/html')
+    return asset_response(page_asset)
+
+@app.route(STYLESHEET_URL)
+def stylesheet():
+    """Serve the page's stylesheet (versioned URL, cached for good)"""
+    return asset_response(stylesheet_asset)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """Main chat endpoint - EXACT ORIGINAL LOGIC"""
+    """Main chat endpoint: admits the request, then answers with every thinking step at once"""
+    trace = begin_trace("POST /api/chat", request.headers)
+    with tracer.activate(trace):
+        response, status = _chat()
+    tracer.finish(trace, status=status)
+    if trace is not None:
+        response.headers["X-Stark-Trace-Id"] = trace.id
+    return response, status
+
+def _chat():
     try:
-        data = request.get_json()
-        message = data.get('message', '')
-        conversation_id = data.get('conversation_id', f"conv_{os.urandom(8).hex()}")
-        
-        if not message:
-            return jsonify({"error": "Message is required"}), 400
+        with span("parse_request"):
+            options, error = parse_chat_request(request.get_json())
+        if error:
+            return jsonify({"error": error}), 400
         
         # Generate response with thinking steps
-        steps = generate_stark_response(message, conversation_id)
+        options.pop("stream_tokens")
+        with span("admission"):
+            admit(client_address(), options["conversation_id"])
+        try:
+            steps = generate_stark_response(**options)
+        finally:
+            leave(options["conversation_id"])
         
-        return jsonify({
-            "conversation_id": conversation_id,
-            "steps": steps
-        })
+        with span("serialize"):
+            return jsonify({
+                "conversation_id": options["conversation_id"],
+                "steps": steps
+            }), 200
         
+    except Rejected as e:
+        return rejection_response(e)
     except Exception as e:
+        metrics.inc("stark_errors_total", ("request",))
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming chat endpoint - sends each thinking step as a Server-Sent Event the moment it is parsed"""
+    trace = begin_trace("POST /api/chat/stream", request.headers)
+    with tracer.activate(trace), span("parse_request"):
+        options, error = parse_chat_request(request.get_json(silent=True))
+    if error:
+        tracer.finish(trace, status=400)
+        return jsonify({"error": error}), 400
+    conversation_id = options["conversation_id"]
+    try:
+        with tracer.activate(trace), span("admission"):
+            admit(client_address(), conversation_id)
+    except Rejected as e:
+        tracer.finish(trace, status=e.status)
+        return rejection_response(e)
+    
+    def events():
+        try:
+            with tracer.activate(trace):
+                yield sse_event("meta", {"conversation_id": conversation_id})
+                try:
+                    for event, payload in iter_stark_steps(**options):
+                        yield sse_event(event, payload)
+                except Exception as e:
+                    metrics.inc("stark_errors_total", ("request",))
+                    yield sse_event("error", {"error": str(e)})
+                yield sse_event("done", {"conversation_id": conversation_id})
+        finally:
+            tracer.finish(trace, status=200)
+    
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if trace is not None:
+        headers["X-Stark-Trace-Id"] = trace.id
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+    # Runs even if the client goes away before the stream starts
+    response.call_on_close(lambda: leave(conversation_id))
+    return response
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Batch chat endpoint - runs items concurrently and streams one NDJSON line per item, in completion order"""
+    groups, concurrency, error = parse_batch_request(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        # A batch counts as one request against the client's rate limit; items still take generation slots
+        admission.check_rate(client_address())
+    except Rejected as e:
+        return rejection_response(e)
+    
+    def lines():
+        for record in iter_batch(groups, concurrency):
+            yield json.dumps(record) + "\n"
+    
+    return Response(lines(), mimetype='application/x-ndjson', headers={"X-Accel-Buffering": "no"})
+
 @app.route('/api/health')
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        "status": "online",
-        "message": "Arc Reactor at full capacity. STARK AI operational."
-    })
+    return jsonify(health_status())
+
+@app.route('/api/metrics')
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/debug/traces')
+def debug_traces():
+    """Most recent sampled traces, newest first"""
+    limit = request.args.get('limit', type=int)
+    return jsonify({"sample_rate": tracer.sample_rate, "traces": tracer.recent(limit)})
 
 @app.route('/api/reset/<conversation_id>', methods=['POST'])
 def reset_conversation(conversation_id):
     """Reset a conversation"""
-    if conversation_id in conversations:
-        del conversations[conversation_id]
+    reset_conversation_state(conversation_id)
     return jsonify({"message": "Conversation reset. Let's start fresh, shall we?"})
 
 # Vercel entry point
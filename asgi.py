@@ -0,0 +1,495 @@
+# asgi.py
+"""Async serving path: the same routes as app.py on an ASGI server, backed by AsyncOpenAI.
+
+Each chat holds no thread while it waits on OpenAI, so one process can serve hundreds of
+concurrent conversations. Run it with:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import math
+import os
+import re
+
+import app as stark
+from admission import Rejected, WaitQueue
+
+# Global cap on in-flight upstream calls, and the shared HTTP connection pool behind them
+MAX_INFLIGHT_UPSTREAM = int(os.getenv("STARK_MAX_INFLIGHT_UPSTREAM", 256))
+HTTP_POOL_SIZE = int(os.getenv("STARK_HTTP_POOL_SIZE", MAX_INFLIGHT_UPSTREAM))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("STARK_HTTP_KEEPALIVE", 30))
+
+async_client = None
+_upstream_slots = None
+
+
+def get_async_client():
+    """Shared AsyncOpenAI client with a pooled, keep-alive HTTP connection pool"""
+    global async_client
+    if async_client is None and stark.LLM_BACKEND == "mock":
+        async_client = stark.get_client().async_client()
+    if async_client is None:
+        # Imported on first use, like the sync client (see app.LAZY_INIT)
+        import httpx
+        import openai
+        async_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,  # Retries are stark.upstream's job, as on the sync path
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_SIZE,
+                    max_keepalive_connections=HTTP_POOL_SIZE,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+                ),
+                timeout=httpx.Timeout(stark.UPSTREAM_TIMEOUT, connect=5.0)
+            )
+        )
+    return async_client
+
+
+def upstream_slots():
+    """Semaphore limiting in-flight upstream calls (created inside the running event loop)"""
+    global _upstream_slots
+    if _upstream_slots is None:
+        _upstream_slots = asyncio.Semaphore(MAX_INFLIGHT_UPSTREAM)
+    return _upstream_slots
+
+
+async def _in_thread(fn, *args):
+    # Pipeline steps touch the conversation store (SQLite or log I/O with a shared backend); summaries are "call" events
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def _create(**request_kwargs):
+    async with upstream_slots():
+        return await get_async_client().chat.completions.create(**request_kwargs)
+
+
+async def _create_hedged(request_kwargs):
+    """Async twin of app._create_hedged; the slower request is cancelled"""
+    delay = stark.upstream.hedge_delay(request_kwargs)
+    if delay is None:
+        return await _create(**request_kwargs)
+    primary = asyncio.ensure_future(_create(**request_kwargs))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    backup = asyncio.ensure_future(_create(**request_kwargs))
+    pending, error = {primary, backup}, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    stark.upstream.record_hedge(won=future is backup)
+                    return future.result()
+                error = future.exception()
+        stark.upstream.record_hedge(won=False)
+        raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def call_upstream(request_kwargs, stream=False):
+    """Async twin of app.call_upstream"""
+    attempts = stark.upstream.attempts(request_kwargs)
+    try:
+        kind, payload = next(attempts)
+        while True:
+            if kind == "sleep":
+                await asyncio.sleep(payload)
+                kind, payload = attempts.send(None)
+                continue
+            try:
+                if stream:
+                    result = await get_async_client().chat.completions.create(stream=True, stream_options=stark.STREAM_OPTIONS, **payload)
+                else:
+                    result = await _create_hedged(payload)
+            except Exception as e:
+                kind, payload = attempts.send((None, e))
+            else:
+                kind, payload = attempts.send((result, None))
+    except StopIteration as done:
+        return done.value
+
+
+async def aiter_stark_steps(message, conversation_id, stream_tokens=False, mode=None, max_steps=None, deadline=None):
+    """Async twin of app.iter_stark_steps - drives the same pipeline with AsyncOpenAI"""
+    run = stark.PipelineRun(stark.stark_pipeline(message, conversation_id, stream_tokens, mode, max_steps, deadline))
+    try:
+        event = await _in_thread(run.advance)
+        while event is not None:
+            kind, payload = event
+            reply = error = usage = None
+            if kind == "call":
+                try:
+                    response = await call_upstream(payload)
+                    reply, usage = response.choices[0].message.content, response.usage
+                except Exception as e:
+                    error = e
+            elif kind == "wait":
+                # An identical request is generating - wait for it without holding a thread
+                future, timeout = payload
+                try:
+                    reply = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+                except asyncio.TimeoutError:
+                    reply = None
+            elif kind == "stream":
+                streamer, parts = stark.StepContentStreamer(), []
+                try:
+                    async with upstream_slots():
+                        stream = await call_upstream(payload, stream=True)
+                        async for chunk in stream:
+                            usage = chunk.usage or usage
+                            if not chunk.choices or not chunk.choices[0].delta.content:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            parts.append(delta)
+                            token = stark.token_event(streamer, delta)
+                            if token:
+                                yield token
+                    reply = "".join(parts)
+                except Exception as e:
+                    error = e
+            else:
+                yield event
+            event = await _in_thread(run.advance, reply, error, usage)
+    finally:
+        run.close()
+
+
+async def generate_stark_response(message, conversation_id, mode=None, max_steps=None, deadline=None):
+    """Async twin of app.generate_stark_response"""
+    events = aiter_stark_steps(message, conversation_id, mode=mode, max_steps=max_steps, deadline=deadline)
+    return [data async for event, data in events if event == "step"]
+
+
+# Minimal ASGI plumbing
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+
+async def _read_json(receive):
+    body, more = b"", True
+    while more:
+        message = await receive()
+        body += message.get("body", b"")
+        more = message.get("more_body", False)
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _client_address(scope):
+    return stark.forwarded_client(_header(scope, b"x-forwarded-for"), scope["client"][0] if scope.get("client") else None)
+
+
+async def _wait_for(future, timeout):
+    """Async twin of app._wait_for"""
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return not WaitQueue.give_up(future)
+
+
+async def admit(scope, conversation_id):
+    """Async twin of app.admit - waits without holding a thread. Pair with app.leave()"""
+    stark.admission.check_rate(_client_address(scope))
+    await enter(conversation_id)
+
+
+async def enter(conversation_id):
+    """Async twin of app.enter"""
+    admission = stark.admission
+    if not await _wait_for(admission.conversation_lock(conversation_id), admission.conversation_timeout):
+        raise admission.conversation_busy()
+    try:
+        if not await _sleep_through(admission.process_lock(conversation_id)):
+            raise admission.conversation_busy()
+        if not await _wait_for(admission.slot(), admission.wait_timeout):
+            raise admission.overloaded()
+    except Rejected:
+        admission.release_conversation(conversation_id)
+        raise
+
+
+async def _sleep_through(waits):
+    """Async twin of app._sleep_through"""
+    try:
+        while True:
+            await asyncio.sleep(next(waits))
+    except StopIteration as done:
+        return done.value
+
+
+def _rejection(rejected):
+    headers = [(b"retry-after", str(math.ceil(rejected.retry_after)).encode())] if rejected.retry_after is not None else []
+    return {"error": rejected.message}, rejected.status, headers
+
+
+def _begin_trace(scope):
+    return stark.begin_trace(f"{scope['method']} {scope['path']}", {"X-Stark-Profile": _header(scope, b"x-stark-profile")})
+
+
+async def _respond(send, status, body, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())] + CORS_HEADERS + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _respond_json(send, payload, status=200):
+    await _respond(send, status, json.dumps(payload).encode(), "application/json")
+
+
+async def _respond_asset(scope, send, asset):
+    status, headers, body = asset.respond(_header(scope, b"accept-encoding"), _header(scope, b"if-none-match"))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()] + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def index(scope, receive, send):
+    """Serve the main page directly"""
+    await _respond_asset(scope, send, stark.page_asset)
+
+
+async def stylesheet(scope, receive, send):
+    """Serve the page's stylesheet"""
+    await _respond_asset(scope, send, stark.stylesheet_asset)
+
+
+async def chat(scope, receive, send):
+    """Main chat endpoint"""
+    trace = _begin_trace(scope)
+    # The pipeline profiles itself on its executor thread; profiling the event loop would catch other requests
+    with stark.tracer.activate(trace, profile=False):
+        payload, status, headers = await _chat(scope, receive)
+        with stark.span("serialize"):
+            body = json.dumps(payload).encode()
+    stark.tracer.finish(trace, status=status)
+    if trace is not None:
+        headers.append((b"x-stark-trace-id", trace.id.encode()))
+    await _respond(send, status, body, "application/json", headers)
+
+
+async def _chat(scope, receive):
+    try:
+        body = await _read_json(receive)
+        with stark.span("parse_request"):
+            options, error = stark.parse_chat_request(body)
+        if error:
+            return {"error": error}, 400, []
+        options.pop("stream_tokens")
+        with stark.span("admission"):
+            await admit(scope, options["conversation_id"])
+        try:
+            steps = await generate_stark_response(**options)
+        finally:
+            stark.leave(options["conversation_id"])
+        return {"conversation_id": options["conversation_id"], "steps": steps}, 200, []
+    except Rejected as e:
+        return _rejection(e)
+    except Exception as e:
+        stark.metrics.inc("stark_errors_total", ("request",))
+        return {"error": str(e)}, 500, []
+
+
+async def chat_stream(scope, receive, send):
+    """Streaming chat endpoint - one Server-Sent Event per step"""
+    trace = _begin_trace(scope)
+    try:
+        with stark.tracer.activate(trace, profile=False):
+            await _chat_stream(scope, send, await _read_json(receive), trace)
+    finally:
+        stark.tracer.finish(trace)
+
+
+async def _chat_stream(scope, send, body, trace):
+    with stark.span("parse_request"):
+        options, error = stark.parse_chat_request(body)
+    if error:
+        if trace is not None:
+            trace.attrs.update(status=400)
+        return await _respond_json(send, {"error": error}, 400)
+    conversation_id = options["conversation_id"]
+    try:
+        with stark.span("admission"):
+            await admit(scope, conversation_id)
+    except Rejected as e:
+        payload, status, headers = _rejection(e)
+        if trace is not None:
+            trace.attrs.update(status=status)
+        return await _respond(send, status, json.dumps(payload).encode(), "application/json", headers)
+    try:
+        await _stream_steps(send, options, trace)
+    finally:
+        stark.leave(conversation_id)
+
+
+async def _stream_steps(send, options, trace):
+    conversation_id = options["conversation_id"]
+    headers = [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")] + CORS_HEADERS
+    if trace is not None:
+        trace.attrs.update(status=200)
+        headers.append((b"x-stark-trace-id", trace.id.encode()))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    async def emit(event, data):
+        await send({"type": "http.response.body", "body": stark.sse_event(event, data).encode(), "more_body": True})
+
+    await emit("meta", {"conversation_id": conversation_id})
+    try:
+        async for event, payload in aiter_stark_steps(**options):
+            await emit(event, payload)
+    except Exception as e:
+        stark.metrics.inc("stark_errors_total", ("request",))
+        await emit("error", {"error": str(e)})
+    await emit("done", {"conversation_id": conversation_id})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _run_batch_item(index, options, error):
+    """Async twin of app.run_batch_item"""
+    if error:
+        return {"index": index, "error": error, "status": 400}
+    conversation_id = options["conversation_id"]
+    try:
+        await enter(conversation_id)
+    except Rejected as e:
+        return {"index": index, "conversation_id": conversation_id, "error": e.message, "status": e.status}
+    try:
+        return {"index": index, "conversation_id": conversation_id, "steps": await generate_stark_response(**options)}
+    except Exception as e:
+        stark.metrics.inc("stark_errors_total", ("request",))
+        return {"index": index, "conversation_id": conversation_id, "error": str(e), "status": 500}
+    finally:
+        stark.leave(conversation_id)
+
+
+async def chat_batch(scope, receive, send):
+    """Batch chat endpoint - one NDJSON line per item, in completion order"""
+    groups, concurrency, error = stark.parse_batch_request(await _read_json(receive))
+    if error:
+        return await _respond_json(send, {"error": error}, 400)
+    try:
+        stark.admission.check_rate(_client_address(scope))
+    except Rejected as e:
+        payload, status, headers = _rejection(e)
+        return await _respond(send, status, json.dumps(payload).encode(), "application/json", headers)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/x-ndjson"), (b"x-accel-buffering", b"no")] + CORS_HEADERS,
+    })
+    results = asyncio.Queue()
+    pending = iter(groups)
+
+    async def worker():
+        # Workers share one iterator; groups keep their own items in order
+        for group in pending:
+            for item in group:
+                await results.put(await _run_batch_item(*item))
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(groups)))]
+    try:
+        for _ in range(sum(len(group) for group in groups)):
+            record = await results.get()
+            await send({"type": "http.response.body", "body": (json.dumps(record) + "\n").encode(), "more_body": True})
+    finally:
+        for task in workers:
+            task.cancel()
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def health_check(scope, receive, send):
+    """Health check endpoint"""
+    await _respond_json(send, stark.health_status())
+
+
+async def metrics_endpoint(scope, receive, send):
+    """Prometheus metrics"""
+    await _respond(send, 200, stark.metrics.render().encode(), stark.METRICS_CONTENT_TYPE)
+
+
+async def debug_traces(scope, receive, send):
+    """Most recent sampled traces, newest first"""
+    limit = re.search(rb"(?:^|&)limit=(\d+)", scope.get("query_string", b""))
+    traces = stark.tracer.recent(int(limit.group(1)) if limit else None)
+    await _respond_json(send, {"sample_rate": stark.tracer.sample_rate, "traces": traces})
+
+
+async def reset_conversation(scope, receive, send, conversation_id):
+    """Reset a conversation"""
+    await _in_thread(stark.reset_conversation_state, conversation_id)
+    await _respond_json(send, {"message": "Conversation reset. Let's start fresh, shall we?"})
+
+
+ROUTES = [
+    ("GET", re.compile(r"^/$"), index),
+    ("GET", re.compile("^" + re.escape(stark.STYLESHEET_URL) + "$"), stylesheet),
+    ("POST", re.compile(r"^/api/chat$"), chat),
+    ("POST", re.compile(r"^/api/chat/stream$"), chat_stream),
+    ("POST", re.compile(r"^/api/chat/batch$"), chat_batch),
+    ("GET", re.compile(r"^/api/health$"), health_check),
+    ("GET", re.compile(r"^/api/metrics$"), metrics_endpoint),
+    ("GET", re.compile(r"^/api/debug/traces$"), debug_traces),
+    ("POST", re.compile(r"^/api/reset/([^/]+)$"), reset_conversation),
+]
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if async_client is not None:
+                await async_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS":
+        # CORS preflight, matching Flask-CORS defaults
+        return await _respond(send, 204, b"", "text/plain", [
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+            (b"access-control-allow-headers", b"Content-Type"),
+        ])
+
+    allowed = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        if method == route_method or (method == "HEAD" and route_method == "GET"):
+            return await handler(scope, receive, send, *match.groups())
+        allowed = True
+    if allowed:
+        return await _respond_json(send, {"error": "Method not allowed"}, 405)
+    await _respond_json(send, {"error": "Not found"}, 404)
@@ -0,0 +1,104 @@
+"""Measure cold starts: import time and first-request latency per route, eager vs lazy init.
+
+Every sample runs in a fresh interpreter, like a new serverless instance, with
+STARK_LAZY_INIT=0 and =1. The app is configured for OpenAI (with a dummy key, nothing is
+sent) so the import carries its real weight; the chat route answers from the mock LLM
+instead, and the "client" row times creating the OpenAI client, which lazy init moves
+into the first chat. Runs fully offline:
+
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = ("health", "page", "stylesheet", "chat", "client")
+
+
+def child(route):
+    """Runs in the fresh interpreter: import the app, then hit one route twice"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app
+    imported = time.perf_counter()
+
+    http = app.app.test_client()
+    headers = {"Accept-Encoding": "gzip, deflate, br"}
+    requests = {
+        "health": lambda: http.get("/api/health"),
+        "page": lambda: http.get("/", headers=headers),
+        "stylesheet": lambda: http.get(app.STYLESHEET_URL, headers=headers),
+        "chat": lambda: http.post("/api/chat", json={"message": "How would you build a better arc reactor?"}),
+        "client": app.get_client,
+    }
+    timings = []
+    for _ in range(2):
+        t = time.perf_counter()
+        response = requests[route]()
+        timings.append(time.perf_counter() - t)
+        if route != "client":
+            assert response.status_code == 200, response.status_code
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "first_ms": timings[0] * 1000,
+        "second_ms": timings[1] * 1000,
+        "openai_loaded": "openai" in sys.modules,
+    }))
+
+
+def sample(route, lazy):
+    env = dict(
+        os.environ,
+        STARK_LAZY_INIT="1" if lazy else "0",
+        STARK_STORE_BACKEND="memory",
+        OPENAI_API_KEY="sk-cold-start-bench",
+        STARK_LLM_BACKEND="mock" if route == "chat" else "openai",
+        STARK_MOCK_LATENCY="0",
+    )
+    out = subprocess.run([sys.executable, __file__, "--child", route], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(runs):
+    results = []
+    for route in ROUTES:
+        for lazy in (False, True):
+            samples = [sample(route, lazy) for _ in range(runs)]
+            results.append({
+                "route": route,
+                "init": "lazy" if lazy else "eager",
+                "import_ms": round(statistics.median(s["import_ms"] for s in samples), 1),
+                "first_ms": round(statistics.median(s["first_ms"] for s in samples), 2),
+                "second_ms": round(statistics.median(s["second_ms"] for s in samples), 2),
+                "openai_loaded": samples[-1]["openai_loaded"],
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per route and mode (the median is reported)")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per route and mode")
+    parser.add_argument("--child", choices=ROUTES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    results = run(args.runs)
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'route':<12}{'init':<7}{'import ms':>11}{'first ms':>11}{'second ms':>11}  openai loaded")
+    for r in results:
+        print(f"{r['route']:<12}{r['init']:<7}{r['import_ms']:>11}{r['first_ms']:>11}{r['second_ms']:>11}  {r['openai_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
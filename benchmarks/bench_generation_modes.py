@@ -0,0 +1,93 @@
+"""Compare stepwise vs single-call generation against a mock OpenAI client.
+
+Reports upstream calls, prompt tokens and wall time per mode. Runs fully offline:
+
+    python benchmarks/bench_generation_modes.py --requests 20 --latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Every run asks the same questions; cached answers would hide the calls being compared
+os.environ.setdefault("STARK_RESPONSE_CACHE_SIZE", "0")
+
+import app  # noqa: E402
+
+
+def count_tokens(messages):
+    """Rough prompt token estimate (~4 characters per token)"""
+    return sum(len(m["content"]) for m in messages) // 4 + 4 * len(messages)
+
+
+class MockCompletions:
+    """Stands in for client.chat.completions and answers in whichever mode is asked for"""
+
+    def __init__(self, latency, per_token_latency):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    def create(self, messages, **kwargs):
+        self.calls += 1
+        prompt_tokens = count_tokens(messages)
+        self.prompt_tokens += prompt_tokens
+        time.sleep(self.latency + prompt_tokens * self.per_token_latency)
+
+        if messages[-1]["content"] == app.SINGLE_CALL_PROMPT:
+            payload = {"steps": [self._step(name) for name in app.STEP_ORDER]}
+        else:
+            done = sum(1 for m in messages if m["role"] == "user" and m["content"] == "Continue to the next step.")
+            payload = self._step(app.STEP_ORDER[min(done, len(app.STEP_ORDER) - 1)])
+        message = types.SimpleNamespace(content=json.dumps(payload))
+        usage = types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(message.content) // 4, total_tokens=None)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+    @staticmethod
+    def _step(name):
+        content = f"{name.upper()}: " + "Genius-level reasoning, obviously. " * 6
+        return {"step": name, "content": content, "final": name == "result"}
+
+
+def run(mode, requests, turns, latency, per_token_latency):
+    completions = MockCompletions(latency, per_token_latency)
+    app.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+
+    start = time.perf_counter()
+    for i in range(requests):
+        conversation_id = f"bench_{mode}_{i}"
+        for turn in range(turns):
+            steps = app.generate_stark_response(f"Question {turn}: how does the arc reactor work?", conversation_id, mode=mode)
+            assert [s["step"] for s in steps] == app.STEP_ORDER, steps
+        app.conversations.delete(conversation_id)
+    elapsed = time.perf_counter() - start
+
+    total = requests * turns
+    return {
+        "mode": mode,
+        "calls/msg": completions.calls / total,
+        "prompt tok/msg": completions.prompt_tokens / total,
+        "ms/msg": elapsed * 1000 / total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10, help="conversations per mode")
+    parser.add_argument("--turns", type=int, default=3, help="user messages per conversation")
+    parser.add_argument("--latency", type=float, default=0.02, help="fixed mock latency per call (s)")
+    parser.add_argument("--per-token-latency", type=float, default=0.00001, help="mock latency per prompt token (s)")
+    args = parser.parse_args()
+
+    rows = [run(mode, args.requests, args.turns, args.latency, args.per_token_latency) for mode in app.GENERATION_MODES]
+    print(f"{'mode':<10} {'calls/msg':>10} {'prompt tok/msg':>15} {'ms/msg':>10}")
+    for row in rows:
+        print(f"{row['mode']:<10} {row['calls/msg']:>10.2f} {row['prompt tok/msg']:>15.0f} {row['ms/msg']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
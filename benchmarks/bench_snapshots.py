@@ -0,0 +1,90 @@
+"""Measure conversation store snapshots: size, write time, restore time and first-access latency.
+
+Fills a store with synthetic conversations (one shared system prompt, then unique user
+and assistant turns), snapshots it, and restores it into a fresh store the way the app
+does at startup. Restore time should barely move as conversations get longer, since
+only the index is read up front. Runs fully offline:
+
+    python benchmarks/bench_snapshots.py --conversations 1000 10000 50000 --turns 6
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_store import ConversationStore
+from snapshots import Snapshotter
+
+WORDS = "arc reactor suit repulsor jarvis armor flight thruster palladium vibranium nanotech stark expo".split()
+SYSTEM_PROMPT = {"role": "system", "content": " ".join(WORDS * 25)}
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def fill(store, conversations, turns, rng):
+    for n in range(conversations):
+        conversation_id = f"conv_{n:08x}"
+        store.get_or_create(conversation_id, [SYSTEM_PROMPT])
+        for _ in range(turns):
+            store.append(conversation_id, {"role": "user", "content": text(rng, 15)},
+                         {"role": "assistant", "content": text(rng, 80)})
+
+
+def run(conversations, turns, directory):
+    rng = random.Random(conversations)
+    path = os.path.join(directory, f"bench_{conversations}_{turns}.snap")
+    store = ConversationStore(max_conversations=conversations, max_bytes=1 << 40)
+    fill(store, conversations, turns, rng)
+    snapshotter = Snapshotter(store, path)
+    snapshotter.save()
+
+    restored = ConversationStore(max_conversations=conversations, max_bytes=1 << 40)
+    restorer = Snapshotter(restored, path)
+    restorer.restore()
+    ids = [f"conv_{n:08x}" for n in rng.sample(range(conversations), min(conversations, 200))]
+    first_access = []
+    for conversation_id in ids:
+        t = time.perf_counter()
+        restored.get(conversation_id)
+        first_access.append(time.perf_counter() - t)
+    os.remove(path)
+    return {
+        "conversations": conversations,
+        "turns": turns,
+        "history_mb": round(store.total_bytes / 1e6, 2),
+        "snapshot_mb": round(snapshotter.last_bytes / 1e6, 2),
+        "write_ms": round(snapshotter.last_seconds * 1000, 1),
+        "restore_ms": round(restorer.restore_seconds * 1000, 1),
+        "first_access_us": round(statistics.median(first_access) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--turns", type=int, nargs="+", default=[2, 10], help="user/assistant exchanges per conversation")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per configuration")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run(c, t, directory) for c in args.conversations for t in args.turns]
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'conversations':>13}{'turns':>7}{'history MB':>12}{'snapshot MB':>13}{'write ms':>10}{'restore ms':>12}{'first access us':>17}")
+    for r in results:
+        print(f"{r['conversations']:>13}{r['turns']:>7}{r['history_mb']:>12}{r['snapshot_mb']:>13}"
+              f"{r['write_ms']:>10}{r['restore_ms']:>12}{r['first_access_us']:>17}")
+
+
+if __name__ == "__main__":
+    main()
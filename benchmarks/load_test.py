@@ -0,0 +1,229 @@
+"""Load-test the chat endpoints against the mock LLM backend.
+
+Starts the app in-process (Flask under a threaded WSGI server, or the ASGI app under
+uvicorn) with STARK_LLM_BACKEND=mock, drives an endpoint at a fixed concurrency, and
+reports requests/sec (and items/sec for batches), latency percentiles, upstream calls and
+estimated cost per request and server memory growth. Runs fully offline:
+
+    python benchmarks/load_test.py --server flask --endpoint chat --concurrency 32 --requests 2000
+    python benchmarks/load_test.py --server asgi --endpoint stream --latency 0.2 --jitter 0.05
+    python benchmarks/load_test.py --endpoint batch --batch-size 20 --concurrency 4 --requests 100
+
+--url points it at an already running server instead (memory growth is not reported then).
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_UPSTREAM_COUNT_RE = re.compile(r"^stark_upstream_seconds_count\{[^}]*\} (\d+)", re.M)
+_COST_RE = re.compile(r"^stark_route_cost_usd_total\{[^}]*\} (\S+)", re.M)
+
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind):
+    """Serve the app from a background thread; returns its base URL"""
+    port = _free_port()
+    if kind == "flask":
+        from werkzeug.serving import make_server
+        import app
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No access log per request
+        server = make_server("127.0.0.1", port, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        import uvicorn
+        import asgi
+        server = uvicorn.Server(uvicorn.Config(asgi.application, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def upstream_usage(http, url):
+    """Total OpenAI (mock) calls and their estimated cost in USD so far, read from /api/metrics"""
+    text = http.get(f"{url}/api/metrics").text
+    return sum(int(n) for n in _UPSTREAM_COUNT_RE.findall(text)), sum(float(n) for n in _COST_RE.findall(text))
+
+
+def one_request(http, url, endpoint, i, args):
+    """Send request i; returns (ok, latency, time to first event)"""
+    conversation_id = f"load_{i % args.conversations}"
+    message = f"Question {i % args.unique}: how would you build a better arc reactor?"
+    body = {"message": message, "conversation_id": conversation_id}
+    started = time.perf_counter()
+    if endpoint == "chat":
+        response = http.post(f"{url}/api/chat", json=body)
+        ok = response.status_code == 200 and response.json()["steps"][-1]["step"] == "result"
+        return ok, time.perf_counter() - started, None
+    if endpoint == "batch":
+        items = [{"message": f"{message} (part {n})", "conversation_id": f"{conversation_id}_{n}"} for n in range(args.batch_size)]
+        first = None
+        done = 0
+        with http.stream("POST", f"{url}/api/chat/batch", json={"items": items}) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if first is None:
+                    first = time.perf_counter() - started
+                done += "steps" in json.loads(line)
+        ok = response.status_code == 200 and done == args.batch_size
+        return ok, time.perf_counter() - started, first
+
+    first = None
+    ok = False
+    body["stream_tokens"] = True
+    with http.stream("POST", f"{url}/api/chat/stream", json=body) as response:
+        for line in response.iter_lines():
+            if first is None and line.startswith("event:"):
+                first = time.perf_counter() - started
+            if line.startswith("event: done"):
+                ok = response.status_code == 200
+    return ok, time.perf_counter() - started, first
+
+
+WARMUP_REQUESTS = 32
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(url, args):
+    http = httpx.Client(timeout=120, limits=httpx.Limits(max_connections=args.concurrency + 4))
+    # Warm up (imports, first connections) before measuring - concurrently, or a high
+    # --concurrency with slow mock calls spends the whole run warming up
+    warmup = [
+        threading.Thread(target=one_request, args=(http, url, args.endpoint, args.requests + i, args))
+        for i in range(min(args.concurrency, args.requests, WARMUP_REQUESTS))
+    ]
+    for thread in warmup:
+        thread.start()
+    for thread in warmup:
+        thread.join()
+
+    calls_before, cost_before = upstream_usage(http, url)
+    rss_before = rss_bytes() if not args.url else None
+    latencies, first_events, failures = [], [], [0]
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                ok, latency, first = one_request(http, url, args.endpoint, i, args)
+            except httpx.HTTPError:
+                ok, latency, first = False, 0.0, None
+            with lock:
+                if ok:
+                    latencies.append(latency)
+                    if first is not None:
+                        first_events.append(first)
+                else:
+                    failures[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    calls, cost = upstream_usage(http, url)
+    calls, cost = calls - calls_before, cost - cost_before
+    http.close()
+    items = args.requests * (args.batch_size if args.endpoint == "batch" else 1)
+    return {
+        "server": "external" if args.url else args.server,
+        "endpoint": args.endpoint,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "failures": failures[0],
+        "rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies, default=0) * 1000, 1),
+        "first_event_p50_ms": round(percentile(first_events, 50) * 1000, 1) if first_events else None,
+        "items_per_sec": round(items / elapsed, 1),
+        "upstream_calls_per_request": round(calls / args.requests, 2),
+        "cost_per_item_usd": round(cost / items, 6),
+        "rss_growth_mb": round((rss_bytes() - rss_before) / 2**20, 1) if rss_before is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask", help="app to start in-process")
+    parser.add_argument("--url", help="test an already running server instead")
+    parser.add_argument("--endpoint", choices=("chat", "stream", "batch"), default="chat")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=10, help="items per request with --endpoint batch")
+    parser.add_argument("--conversations", type=int, default=10**9, help="distinct conversation ids (default: one per request)")
+    parser.add_argument("--unique", type=int, default=10**9, help="distinct messages (lower it to exercise the caches)")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock latency per call (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mock latency jitter (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock calls that fail")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of mock replies that are not valid JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print one JSON line (for tracking regressions)")
+    args = parser.parse_args()
+
+    if not args.url:
+        # Configure the app before it is imported
+        os.environ.update({
+            "STARK_LLM_BACKEND": "mock",
+            "STARK_MOCK_LATENCY": str(args.latency),
+            "STARK_MOCK_JITTER": str(args.jitter),
+            "STARK_MOCK_ERROR_RATE": str(args.error_rate),
+            "STARK_MOCK_MALFORMED_RATE": str(args.malformed_rate),
+            "STARK_MOCK_SEED": str(args.seed),
+            "STARK_RATE_LIMIT": "0",  # Every simulated user comes from 127.0.0.1
+        })
+        os.environ.setdefault("STARK_STORE_BACKEND", "memory")
+    url = (args.url or start_server(args.server)).rstrip("/")
+
+    result = run(url, args)
+    if args.json:
+        print(json.dumps(result))
+        return
+    for key, value in result.items():
+        print(f"{key:<28} {value}")
+
+
+if __name__ == "__main__":
+    main()
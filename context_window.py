@@ -0,0 +1,132 @@
+# context_window.py
+import functools
+import threading
+from collections import OrderedDict
+
+_encoding = None
+_encoding_loaded = False
+
+# Per-message overhead the chat format adds on top of the content tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation (older turns were condensed to save space):\n"
+
+
+def _get_encoding():
+    """tiktoken's encoder, loaded on first use rather than at import (it reads a large BPE file)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # tiktoken is optional - fall back to a character estimate
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+@functools.lru_cache(maxsize=16384)
+def count_tokens(text):
+    """Token count for a piece of text, memoized so repeated history is only measured once"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def message_tokens(message):
+    return count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def extractive_summary(previous, messages, max_tokens=300):
+    """Cheap local summarizer: keep the opening of each older turn, newest last, within max_tokens"""
+    lines = [previous] if previous else []
+    for message in messages:
+        content = " ".join(message.get("content", "").split())
+        if len(content) > 160:
+            content = content[:157] + "..."
+        lines.append(f"{message.get('role', 'user')}: {content}")
+    # Drop the oldest lines first until the summary fits
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """Fits a conversation into a token budget for each API call.
+
+    The system prompt is always kept, followed by a rolling summary of older turns
+    and then as many recent turns as fit in the budget. The summary for each
+    conversation is cached along with the index of the first message it does not
+    cover, so it is only extended when more turns fall out of the window. When that
+    happens the window is cut back to `low_watermark` of the budget, so the caller
+    summarizes every few turns rather than on every message.
+    """
+
+    def __init__(self, budget=4000, low_watermark=0.6, max_cached=10000):
+        self.budget = budget
+        self.low_watermark = low_watermark
+        self.max_cached = max_cached
+        self._summaries = OrderedDict()  # conversation_id -> (start, boundary_message, summary)
+        self._lock = threading.Lock()
+        self.summarizations = 0
+
+    def window(self, conversation_id, messages):
+        """A generator that returns the messages to send upstream for this conversation.
+
+        When turns have to be folded into the summary it yields (previous summary, turns)
+        and expects the new summary to be sent back, so the caller decides how (and
+        whether over the network) to summarize.
+        """
+        if not messages:
+            return []
+        head, body_start = ([messages[0]], 1) if messages[0].get("role") == "system" else ([], 0)
+        available = self.budget - sum(message_tokens(m) for m in head)
+
+        start, summary = self._cached(conversation_id, messages, body_start)
+        window_tokens = sum(message_tokens(m) for m in messages[start:])
+        summary_tokens = count_tokens(summary) + MESSAGE_OVERHEAD_TOKENS if summary else 0
+
+        if window_tokens + summary_tokens > available:
+            # Fold the oldest turns into the summary until the window is back under the low watermark
+            target = self.budget * self.low_watermark - summary_tokens - (self.budget - available)
+            new_start = len(messages) - 1  # The latest message is always kept
+            kept = message_tokens(messages[new_start])
+            while new_start - 1 > start and kept + message_tokens(messages[new_start - 1]) <= target:
+                new_start -= 1
+                kept += message_tokens(messages[new_start])
+            # Start the window on a user turn so it never opens with a dangling reply
+            while new_start < len(messages) - 1 and messages[new_start].get("role") != "user":
+                new_start += 1
+
+            if new_start > start:
+                summary = yield summary, messages[start:new_start]
+                self.summarizations += 1
+                start = new_start
+                with self._lock:
+                    self._summaries[conversation_id] = (start, messages[start - 1], summary)
+                    self._summaries.move_to_end(conversation_id)
+                    while len(self._summaries) > self.max_cached:
+                        self._summaries.popitem(last=False)
+
+        if summary:
+            head = head + [{"role": "system", "content": SUMMARY_PREFIX + summary}]
+        return head + messages[start:]
+
+    def forget(self, conversation_id):
+        with self._lock:
+            self._summaries.pop(conversation_id, None)
+
+    def _cached(self, conversation_id, messages, body_start):
+        with self._lock:
+            cached = self._summaries.get(conversation_id)
+            if cached is not None:
+                self._summaries.move_to_end(conversation_id)
+        if cached is None:
+            return body_start, None
+        start, boundary, summary = cached
+        # The history may have been reset or evicted since the summary was made
+        if start >= len(messages) or messages[start - 1] != boundary:
+            self.forget(conversation_id)
+            return body_start, None
+        return start, summary
@@ -0,0 +1,725 @@
+# conversation_store.py
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows - the append log is then only safe within one process
+    fcntl = None
+
+
+def message_size(message):
+    """Approximate memory footprint of a chat message in bytes"""
+    return len(message.get("role", "")) + len(message.get("content", "").encode("utf-8"))
+
+
+class _Entry:
+    __slots__ = ("messages", "nbytes", "last_access", "version", "loader")
+
+    def __init__(self, messages, now, version=None, nbytes=None, loader=None):
+        # Restored entries start without messages: `loader` decodes them on first access
+        self.messages = messages
+        self.nbytes = sum(message_size(m) for m in messages) if nbytes is None else nbytes
+        self.last_access = now
+        self.version = version
+        self.loader = loader
+
+
+class ConversationStore:
+    """Bounded, thread-safe conversation history store with LRU and idle-TTL eviction.
+
+    Conversations live in an OrderedDict kept in access order, so the least recently
+    used conversation is always at the front. Every operation is O(1) amortized:
+    lookups move the entry to the back, and eviction pops from the front until the
+    count, byte and TTL limits hold again.
+
+    With a `backend` (see SQLiteBackend and AppendLogBackend) the store becomes a
+    read-through cache in front of shared storage: writes go to the backend first,
+    and cached entries are checked against the backend's (epoch, length) version on
+    every access, so other worker processes' turns are picked up by fetching only
+    the missing tail. Eviction then only drops the cached copy.
+    """
+
+    def __init__(self, max_conversations=10000, max_bytes=100 * 1024 * 1024, ttl=6 * 3600, clock=time.monotonic, backend=None):
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.changes = 0  # Bumped by every write, so snapshots can skip an unchanged store
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, conversation_id):
+        if self.backend is not None:
+            return self.backend.version(conversation_id) is not None
+        with self._lock:
+            return self._lookup(conversation_id, self._clock()) is not None
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def get(self, conversation_id):
+        """Return a copy of the conversation's messages, or None if it is unknown or expired"""
+        if self.backend is not None:
+            return self._read_through(conversation_id)
+        with self._lock:
+            entry = self._touch(conversation_id, self._clock())
+            return list(entry.messages) if entry else None
+
+    def get_or_create(self, conversation_id, initial):
+        """Return a copy of the conversation's messages, creating it from `initial` if needed"""
+        if self.backend is not None:
+            messages = self._read_through(conversation_id)
+            return messages if messages is not None else self.append(conversation_id, initial=initial)
+        with self._lock:
+            now = self._clock()
+            entry = self._touch(conversation_id, now) or self._create(conversation_id, initial, now)
+            return list(entry.messages)
+
+    def append(self, conversation_id, *messages, initial=None):
+        """Append messages to a conversation and return a copy of its history.
+
+        If the conversation does not exist it is created from `initial` first; without
+        `initial` the messages are dropped and None is returned.
+        """
+        if self.backend is not None:
+            return self._write_through(conversation_id, messages, initial)
+        with self._lock:
+            now = self._clock()
+            entry = self._touch(conversation_id, now)
+            if entry is None:
+                if initial is None:
+                    return None
+                entry = self._create(conversation_id, initial, now)
+            self._extend(entry, messages)
+            self.changes += 1
+            self._evict()
+            return list(entry.messages)
+
+    def delete(self, conversation_id):
+        """Remove a conversation; returns True if it existed"""
+        existed = False
+        if self.backend is not None:
+            existed = self.backend.version(conversation_id) is not None
+            self.backend.delete(conversation_id)
+        with self._lock:
+            self.changes += 1
+            return self._drop(conversation_id) or existed
+
+    def clear(self):
+        """Drop every cached conversation (the backend, if any, is left untouched)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.changes += 1
+
+    def export(self):
+        """(conversation_id, messages, nbytes, seconds idle) for every live conversation, least recently used first.
+
+        Only references are copied under the lock; conversations restored from a
+        snapshot and not used since are decoded afterwards, without being kept.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            live = [(conversation_id, list(entry.messages) if entry.messages is not None else entry.loader,
+                     entry.nbytes, now - entry.last_access)
+                    for conversation_id, entry in self._entries.items()]
+        return [(conversation_id, messages if isinstance(messages, list) else messages(), nbytes, idle)
+                for conversation_id, messages, nbytes, idle in live]
+
+    def restore(self, conversations):
+        """Load (conversation_id, nbytes, seconds idle, loader) tuples, least recently used first, into an empty store.
+
+        A conversation's messages are only decoded, by calling its `loader`, when it is
+        first used. Idle times carry over, so the TTL keeps counting across a restart.
+        Returns how many conversations were restored.
+        """
+        with self._lock:
+            now = self._clock()
+            for conversation_id, nbytes, idle, loader in conversations:
+                if idle < self.ttl:
+                    self._drop(conversation_id)
+                    entry = self._entries[conversation_id] = _Entry(None, now - idle, nbytes=nbytes, loader=loader)
+                    self._bytes += entry.nbytes
+            self._evict()
+            return len(self._entries)
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._lock:
+            self._expire(self._clock())
+            return {
+                "conversations": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # Backend read-through / write-through. Backend I/O happens outside self._lock.
+
+    def _read_through(self, conversation_id):
+        version = self.backend.version(conversation_id)
+        with self._lock:
+            now = self._clock()
+            if version is None:
+                self._drop(conversation_id)
+                self.misses += 1
+                return None
+            entry = self._touch(conversation_id, now)
+            if entry is not None and entry.version == version:
+                return list(entry.messages)
+            # Another worker changed it - fetch only the tail if the epoch still matches
+            cached = entry.messages if entry is not None and entry.version and entry.version[0] == version[0] else []
+
+        version, tail = self.backend.load(conversation_id, start=len(cached))
+        if version is None:
+            with self._lock:
+                self._drop(conversation_id)
+            return None
+        with self._lock:
+            messages = cached + tail
+            self._store(conversation_id, messages, version, self._clock())
+            return list(messages)
+
+    def _write_through(self, conversation_id, messages, initial):
+        with self._lock:
+            entry = self._touch(conversation_id, self._clock())
+            expected = entry.version if entry is not None else None
+
+        version, created = self.backend.append(conversation_id, list(messages), initial)
+        with self._lock:
+            now = self._clock()
+            if version is None:
+                self._drop(conversation_id)
+                return None
+            entry = self._entries.get(conversation_id)
+            if entry is not None and expected and entry.version == expected and version == (expected[0], expected[1] + len(messages)):
+                # Nobody else wrote in between - the cached copy just gains our messages
+                self._extend(entry, messages)
+                entry.version = version
+                entry.last_access = now
+                self._evict()
+                return list(entry.messages)
+            if created:
+                self._store(conversation_id, list(initial) + list(messages), version, now)
+                return list(initial) + list(messages)
+
+        # Interleaved with another worker - reload so the cache matches the backend's order
+        with self._lock:
+            self._drop(conversation_id)
+        return self._read_through(conversation_id)
+
+    # Internal helpers - callers must hold self._lock
+
+    def _lookup(self, conversation_id, now):
+        self._expire(now)
+        return self._entries.get(conversation_id)
+
+    def _touch(self, conversation_id, now):
+        entry = self._lookup(conversation_id, now)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if entry.messages is None:
+            entry.messages = entry.loader()
+            entry.loader = None
+        entry.last_access = now
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _create(self, conversation_id, initial, now):
+        entry = _Entry(list(initial), now)
+        self._entries[conversation_id] = entry
+        self._bytes += entry.nbytes
+        self.changes += 1
+        self._evict()
+        return entry
+
+    def _store(self, conversation_id, messages, version, now):
+        self._drop(conversation_id)
+        entry = _Entry(messages, now, version)
+        self._entries[conversation_id] = entry
+        self._bytes += entry.nbytes
+        self._evict()
+
+    def _extend(self, entry, messages):
+        added = sum(message_size(m) for m in messages)
+        entry.messages.extend(messages)
+        entry.nbytes += added
+        self._bytes += added
+
+    def _drop(self, conversation_id):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.nbytes
+        return True
+
+    def _expire(self, now):
+        # Entries are in access order, so idle ones are always at the front
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.last_access < self.ttl:
+                break
+            self._pop_oldest()
+            self.expirations += 1
+
+    def _evict(self):
+        # Never evict the most recently used conversation, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_conversations or self._bytes > self.max_bytes):
+            self._pop_oldest()
+            self.evictions += 1
+
+    def _pop_oldest(self):
+        _, entry = self._entries.popitem(last=False)
+        self._bytes -= entry.nbytes
+
+
+class _WriteBatcher:
+    """Group commit: writes from concurrent requests are queued and applied in batches by one writer thread.
+
+    Callers block until their batch is durable, so every write is visible to other
+    processes as soon as the call returns. Under load many requests share one
+    transaction (or one log write) instead of paying for their own.
+    """
+
+    def __init__(self, apply_batch, max_batch=128, max_delay=0.0):
+        self._apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op):
+        future = Future()
+        self._queue.put((op, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - time.monotonic()
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self._apply_batch([op for op, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.writes += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class SQLiteBackend:
+    """Conversation storage in a SQLite database in WAL mode, shareable by any number of worker processes.
+
+    Each turn only inserts its new rows. A conversation's version is (epoch, length),
+    where the epoch changes whenever the conversation is reset, so caches can check
+    freshness with a single primary-key lookup and fetch only the missing tail.
+
+    With a `ttl`, the writer thread deletes conversations that haven't been written to
+    for that long, at most every `prune_interval` seconds and a chunk at a time.
+    """
+
+    PRUNE_CHUNK = 500
+
+    def __init__(self, path, batch_delay=0.0, max_batch=128, ttl=None, prune_interval=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.pruned = 0
+        self._next_prune = 0.0
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                epoch TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                epoch TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (conversation_id, epoch, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+        """)
+        self._batcher = _WriteBatcher(self._apply_batch, max_batch=max_batch, max_delay=batch_delay)
+
+    def _connect(self):
+        # One connection per thread; the writer thread gets its own as well
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def version(self, conversation_id):
+        row = self._connect().execute(
+            "SELECT epoch, length FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def load(self, conversation_id, start=0):
+        """Return (version, messages[start:]) or (None, None) if the conversation does not exist"""
+        connection = self._connect()
+        connection.execute("BEGIN")
+        try:
+            row = connection.execute(
+                "SELECT epoch, length FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            rows = connection.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? AND epoch = ? AND seq >= ? ORDER BY seq",
+                (conversation_id, row[0], start)
+            ).fetchall()
+        finally:
+            connection.execute("COMMIT")
+        return tuple(row), [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, conversation_id, messages, initial=None):
+        """Append messages, creating the conversation from `initial` if missing; returns (version, created)"""
+        return self._batcher.submit(("append", conversation_id, messages, initial))
+
+    def delete(self, conversation_id):
+        self._batcher.submit(("delete", conversation_id))
+
+    def _apply_batch(self, ops):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            results = [self._apply(connection, op) for op in ops]
+            if self.ttl and time.monotonic() >= self._next_prune:
+                self._prune(connection)
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return results
+
+    def _prune(self, connection):
+        # Chunked so a large backlog doesn't hold the write lock for long; the rest goes with the next batch
+        ids = [row[0] for row in connection.execute(
+            "SELECT id FROM conversations WHERE updated_at < ? LIMIT ?", (time.time() - self.ttl, self.PRUNE_CHUNK)
+        )]
+        connection.executemany("DELETE FROM messages WHERE conversation_id = ?", [(i,) for i in ids])
+        connection.executemany("DELETE FROM conversations WHERE id = ?", [(i,) for i in ids])
+        self.pruned += len(ids)
+        self._next_prune = time.monotonic() + (self.prune_interval if len(ids) < self.PRUNE_CHUNK else 0)
+
+    def _apply(self, connection, op):
+        if op[0] == "delete":
+            connection.execute("DELETE FROM messages WHERE conversation_id = ?", (op[1],))
+            connection.execute("DELETE FROM conversations WHERE id = ?", (op[1],))
+            return None
+
+        _, conversation_id, messages, initial = op
+        row = connection.execute(
+            "SELECT epoch, length FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        created = row is None
+        if created:
+            if initial is None:
+                return None, False
+            row = (os.urandom(4).hex(), 0)
+            messages = list(initial) + list(messages)
+        epoch, length = row
+        connection.executemany(
+            "INSERT INTO messages (conversation_id, epoch, seq, role, content) VALUES (?, ?, ?, ?, ?)",
+            [(conversation_id, epoch, length + i, m["role"], m["content"]) for i, m in enumerate(messages)]
+        )
+        length += len(messages)
+        connection.execute(
+            "INSERT OR REPLACE INTO conversations (id, epoch, length, updated_at) VALUES (?, ?, ?, ?)",
+            (conversation_id, epoch, length, time.time())
+        )
+        return (epoch, length), created
+
+
+def _write_all(fd, data):
+    # os.write may write less than asked (signals, full disks)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class AppendLogBackend:
+    """Conversation storage in a single append-only JSON-lines log shared by all worker processes.
+
+    Every turn is one appended line. Each process tails the log into a small index of
+    record offsets per conversation (never the message text), and reads records back
+    with pread on demand. Writers take an exclusive flock while appending so lines
+    from different processes never interleave, and a writer cuts off a partial last
+    line left by a crashed one.
+
+    With a `ttl`, conversations not written to for that long drop out of every
+    process's index. Once the log is mostly dead records (expired, deleted or reset
+    conversations), the writer thread compacts it: the live records are copied to a
+    new file that is renamed over the log, and other processes switch to it when they
+    see the path point at a different file.
+    """
+
+    COMPACT_MIN_BYTES = 1 << 20
+
+    def __init__(self, path, batch_delay=0.0, max_batch=128, ttl=None, compact_interval=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.compact_interval = compact_interval
+        self.pruned = 0
+        self.compactions = 0
+        self._next_compact = 0.0
+        self._fd = self._open()
+        self._lock = threading.Lock()
+        self._offset = 0
+        # conversation_id -> [epoch, length, [(seq, count, offset, nbytes), ...], updated_at], least recently written first
+        self._index = OrderedDict()
+        self._batcher = _WriteBatcher(self._apply_batch, max_batch=max_batch, max_delay=batch_delay)
+
+    def _open(self):
+        return os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def version(self, conversation_id):
+        with self._lock:
+            self._catch_up()
+            entry = self._index.get(conversation_id)
+            return (entry[0], entry[1]) if entry else None
+
+    def load(self, conversation_id, start=0):
+        """Return (version, messages[start:]) or (None, None) if the conversation does not exist"""
+        with self._lock:
+            self._catch_up()
+            entry = self._index.get(conversation_id)
+            if entry is None:
+                return None, None
+            # Read under the lock: a compaction may swap the file descriptor
+            messages = []
+            for seq, count, offset, nbytes in entry[2]:
+                if seq + count <= start:
+                    continue
+                record = json.loads(os.pread(self._fd, nbytes, offset))
+                messages.extend({"role": role, "content": content} for role, content in record["m"][max(0, start - seq):])
+            return (entry[0], entry[1]), messages
+
+    def append(self, conversation_id, messages, initial=None):
+        """Append messages, creating the conversation from `initial` if missing; returns (version, created)"""
+        return self._batcher.submit(("append", conversation_id, messages, initial))
+
+    def delete(self, conversation_id):
+        self._batcher.submit(("delete", conversation_id))
+
+    def _apply_batch(self, ops):
+        with self._lock:
+            fd = self._lock_log()
+            try:
+                # Other processes may have appended since we last looked
+                self._catch_up()
+                # Holding the flock, bytes past the last complete line can only be left by a
+                # writer that died mid-write; cut them off so our first line stays parseable
+                if os.fstat(self._fd).st_size > self._offset:
+                    os.ftruncate(self._fd, self._offset)
+                now = time.time()
+                results, lines = [], []
+                for op in ops:
+                    if op[0] == "delete":
+                        lines.append({"c": op[1], "d": 1})
+                        self._index.pop(op[1], None)
+                        results.append(None)
+                        continue
+                    _, conversation_id, messages, initial = op
+                    entry = self._index.get(conversation_id)
+                    created = entry is None
+                    if created:
+                        if initial is None:
+                            results.append((None, False))
+                            continue
+                        entry = self._index[conversation_id] = [os.urandom(4).hex(), 0, [], now]
+                        messages = list(initial) + list(messages)
+                    lines.append({"c": conversation_id, "e": entry[0], "s": entry[1],
+                                  "m": [[m["role"], m["content"]] for m in messages], "t": now})
+                    entry[1] += len(messages)
+                    entry[3] = now
+                    self._index.move_to_end(conversation_id)
+                    results.append(((entry[0], entry[1]), created))
+
+                # One write for the whole batch, then index the new records at their offsets
+                encoded = [json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n" for line in lines]
+                offset = os.fstat(self._fd).st_size
+                try:
+                    _write_all(self._fd, b"".join(encoded))
+                except OSError:
+                    # Drop whatever part made it, and the index entries made for this batch
+                    os.ftruncate(self._fd, offset)
+                    self._index.clear()
+                    self._offset = 0
+                    self._catch_up()
+                    raise
+                for line, data in zip(lines, encoded):
+                    if "m" in line:
+                        self._index[line["c"]][2].append((line["s"], len(line["m"]), offset, len(data)))
+                    offset += len(data)
+                self._offset = offset
+
+                if time.monotonic() >= self._next_compact:
+                    self._next_compact = time.monotonic() + self.compact_interval
+                    try:
+                        self._maybe_compact()
+                    except OSError as e:
+                        # The batch is durable already; the old log simply stays in place
+                        print(f"⚠️ Could not compact {self.path}: {e}")
+                return results
+            finally:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                if fd != self._fd:
+                    os.close(fd)
+
+    def _lock_log(self):
+        # Caller holds self._lock. Another process may compact the log while we wait for the flock,
+        # so only a lock on the file currently at self.path counts
+        while True:
+            self._catch_up()
+            fd = self._fd
+            if not fcntl:
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if not self._replaced():
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _replaced(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _maybe_compact(self):
+        # Caller holds self._lock and the flock
+        live = sum(nbytes for entry in self._index.values() for _, _, _, nbytes in entry[2])
+        if self._offset < self.COMPACT_MIN_BYTES or self._offset < 2 * live:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        index = OrderedDict()
+        offset = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                # Each live conversation becomes a single record, in the same least-recently-written order
+                for conversation_id, (epoch, length, records, updated_at) in self._index.items():
+                    messages = []
+                    for _, _, record_offset, nbytes in records:
+                        messages.extend(json.loads(os.pread(self._fd, nbytes, record_offset))["m"])
+                    data = json.dumps({"c": conversation_id, "e": epoch, "s": 0, "m": messages, "t": updated_at},
+                                      ensure_ascii=False).encode("utf-8") + b"\n"
+                    f.write(data)
+                    index[conversation_id] = [epoch, length, [(0, len(messages), offset, len(data))], updated_at]
+                    offset += len(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        print(f"🗜️ Compacted {self.path}: {self._offset} -> {offset} bytes")
+        # The caller unlocks and closes the old descriptor
+        self._fd = self._open()
+        self._index = index
+        self._offset = offset
+        self.compactions += 1
+
+    def _catch_up(self):
+        # Caller holds self._lock
+        if self._replaced():
+            # Compacted by another process: start over on the new file
+            os.close(self._fd)
+            self._fd = self._open()
+            self._index.clear()
+            self._offset = 0
+        size = os.fstat(self._fd).st_size
+        if size > self._offset:
+            self._read_new(size)
+        self._expire()
+
+    def _read_new(self, size):
+        now = time.time()
+        data = os.pread(self._fd, size - self._offset, self._offset)
+        end = data.rfind(b"\n") + 1  # Ignore a trailing partial line still being written
+        offset = self._offset
+        for raw in data[:end].splitlines(keepends=True):
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                # Torn by a writer that crashed mid-line (e.g. in an older log) - skip it rather than failing every read
+                print(f"⚠️ Skipping corrupt record at offset {offset} in {self.path}")
+                offset += len(raw)
+                continue
+            if "d" in record:
+                self._index.pop(record["c"], None)
+            else:
+                entry = self._index.get(record["c"])
+                if entry is None or entry[0] != record["e"]:
+                    entry = self._index[record["c"]] = [record["e"], 0, [], now]
+                entry[1] = record["s"] + len(record["m"])
+                entry[2].append((record["s"], len(record["m"]), offset, len(raw)))
+                entry[3] = record.get("t", now)  # Records from before timestamps count as fresh
+                self._index.move_to_end(record["c"])
+            offset += len(raw)
+        self._offset = offset
+
+    def _expire(self):
+        # The index is in write order, so conversations idle past the TTL are at the front
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        while self._index:
+            conversation_id, entry = next(iter(self._index.items()))
+            if entry[3] >= cutoff:
+                break
+            del self._index[conversation_id]
+            self.pruned += 1
+
+
+def open_backend(kind, path=None, batch_delay=0.0, ttl=None):
+    """Create a storage backend by name: "memory" (None), "sqlite" or "log\""""
+    if kind in (None, "", "memory"):
+        return None
+    if kind == "sqlite":
+        return SQLiteBackend(path or "stark_conversations.db", batch_delay=batch_delay, ttl=ttl)
+    if kind == "log":
+        return AppendLogBackend(path or "stark_conversations.log", batch_delay=batch_delay, ttl=ttl)
+    raise ValueError(f"Unknown conversation backend: {kind}")
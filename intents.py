@@ -0,0 +1,132 @@
+# intents.py
+import json
+import re
+from collections import deque, namedtuple
+
+IntentMatch = namedtuple("IntentMatch", ["name", "response", "score"])
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that don't change what a short message is asking for
+DEFAULT_FILLER = frozenset("""
+    a an the tony stark mr mister iron man jarvis please pls there so um uh well ok okay just
+""".split())
+
+
+# Function words: they shape a sentence but say nothing about its topic, so leaving them uncovered
+# doesn't count against a pattern - while any uncovered content word ("debug", "python") does
+DEFAULT_FUNCTION_WORDS = frozenset("""
+    i me my mine myself you your yours yourself we us our it its this that these those
+    am is are was were be been being do does did doing done can could will would shall should may might must
+    have has had to of in on at for with about from by into onto up out as and or but if not
+    what whats how hows who whos whom which when where why
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens with apostrophes folded away ("what's" -> "whats")"""
+    return _TOKEN_RE.findall(text.lower().replace("'", "").replace("’", ""))
+
+
+class IntentMatcher:
+    """Answers canned intents locally with a word-level Aho-Corasick automaton.
+
+    Every pattern of every intent is compiled once into a trie with failure links, so
+    a message is scanned in a single pass over its tokens no matter how many patterns
+    there are. An intent's score is the share of the message's content words (neither
+    filler nor function words) its patterns cover; a message of function words only
+    ("how are you") is scored on all of its non-filler words. With the default
+    threshold of 1.0 every content word must be covered, so "hello" and "hey tony!"
+    match the greeting but "can you help me debug?" goes to the model.
+    """
+
+    def __init__(self, intents, threshold=1.0, filler=DEFAULT_FILLER, function_words=DEFAULT_FUNCTION_WORDS):
+        """`intents` maps name -> {"patterns": [...], "response": "..."}"""
+        self.threshold = threshold
+        self.filler = frozenset(filler)
+        self.function_words = frozenset(function_words)
+        self.responses = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # node -> [(intent name, pattern length in tokens)]
+        for name, spec in intents.items():
+            self.responses[name] = spec["response"]
+            for pattern in spec.get("patterns") or [name]:
+                self._add(tokenize(pattern), name)
+        self._link()
+
+    @classmethod
+    def from_responses(cls, responses, aliases=None, **kwargs):
+        """Build from a {phrase: response} table, plus optional extra patterns per phrase"""
+        aliases = aliases or {}
+        return cls({
+            phrase: {"patterns": [phrase] + list(aliases.get(phrase, [])), "response": response}
+            for phrase, response in responses.items()
+        }, **kwargs)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Load intents from JSON: {name: {"patterns": [...], "response": "..."}} or {phrase: response}"""
+        with open(path, encoding="utf-8") as f:
+            table = json.load(f)
+        return cls({
+            name: spec if isinstance(spec, dict) else {"patterns": [name], "response": spec}
+            for name, spec in table.items()
+        }, **kwargs)
+
+    def match(self, text, threshold=None):
+        """Best IntentMatch for a message, or None if nothing covers enough of it"""
+        tokens = tokenize(text)
+        meaningful = sum(1 for t in tokens if t not in self.filler)
+        if not tokens or meaningful > 12:
+            # Long messages are never small talk
+            return None
+
+        covered = {}
+        node = 0
+        for i, token in enumerate(tokens):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for name, length in self._out[node]:
+                covered.setdefault(name, set()).update(range(i - length + 1, i + 1))
+
+        scored = [i for i, t in enumerate(tokens) if t not in self.filler and t not in self.function_words]
+        if not scored:
+            scored = [i for i, t in enumerate(tokens) if t not in self.filler]
+        best = None
+        for name, positions in covered.items():
+            score = sum(1 for p in scored if p in positions) / len(scored) if scored else 1.0
+            if best is None or score > best.score:
+                best = IntentMatch(name, self.responses[name], score)
+        if best is None or best.score < (self.threshold if threshold is None else threshold):
+            return None
+        return best
+
+    def _add(self, tokens, name):
+        if not tokens:
+            return
+        node = 0
+        for token in tokens:
+            nxt = self._goto[node].get(token)
+            if nxt is None:
+                nxt = self._goto[node][token] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((name, len(tokens)))
+
+    def _link(self):
+        # Breadth-first construction of failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(token, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
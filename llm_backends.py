@@ -0,0 +1,176 @@
+# llm_backends.py
+"""LLM backends for the chat pipeline.
+
+A backend is anything shaped like the OpenAI client: `backend.chat.completions.create(**kwargs)`
+returning a completion (or, with stream=True, an iterable of chunks). The app runs against
+OpenAI by default; the mock here answers locally so throughput and tail latency can be
+measured offline.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import types
+
+STEP_ORDER = ["analyze", "think", "validate", "output", "result"]
+CONTINUE_PROMPT = "Continue to the next step."
+
+MOCK_CONTENT = {
+    "analyze": "User wants something built. Parsing the request faster than JARVIS boots up.",
+    "think": "Running the numbers. Repulsor math, mostly. Nothing I haven't done in a cave with a box of scraps.",
+    "validate": "Checked it twice. Physics agrees with me, as usual.",
+    "output": "Formulating an answer worthy of a genius.",
+    "result": "Done. Elegant, efficient, and frankly a little showy. You're welcome."
+}
+
+
+class MockUpstreamError(Exception):
+    """Injected failure from the mock backend, treated like a 503 from OpenAI"""
+
+    status_code = 503
+
+
+def _namespace(**kwargs):
+    return types.SimpleNamespace(**kwargs)
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class _MockCompletions:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def create(self, messages, stream=False, stream_options=None, **kwargs):
+        delay, content, usage = self._backend.plan(messages, kwargs)
+        time.sleep(delay)
+        if content is None:
+            raise MockUpstreamError("Mock upstream error (injected)")
+        if stream:
+            return self._backend.chunks(content, usage, stream_options)
+        return self._backend.completion(content, usage)
+
+
+class _AsyncMockCompletions:
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def create(self, messages, stream=False, stream_options=None, **kwargs):
+        delay, content, usage = self._backend.plan(messages, kwargs)
+        await asyncio.sleep(delay)
+        if content is None:
+            raise MockUpstreamError("Mock upstream error (injected)")
+        if stream:
+            return self._achunks(self._backend.chunks(content, usage, stream_options))
+        return self._backend.completion(content, usage)
+
+    @staticmethod
+    async def _achunks(chunks):
+        for chunk in chunks:
+            yield chunk
+
+
+class MockLLM:
+    """Deterministic local stand-in for the OpenAI client.
+
+    Answers stepwise requests with the next analyze/think/validate/output/result step,
+    single-call requests with all five at once, and anything else (summaries) with plain
+    text. Latency, jitter, injected errors and malformed JSON all come from one seeded
+    random stream, so a sequential run is reproducible call for call.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, malformed_rate=0.0, seed=0, chunk_size=8):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.chunk_size = chunk_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.malformed = 0
+        self.chat = _namespace(completions=_MockCompletions(self))
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=float(os.getenv("STARK_MOCK_LATENCY", 0.05)),
+            jitter=float(os.getenv("STARK_MOCK_JITTER", 0.0)),
+            error_rate=float(os.getenv("STARK_MOCK_ERROR_RATE", 0.0)),
+            malformed_rate=float(os.getenv("STARK_MOCK_MALFORMED_RATE", 0.0)),
+            seed=int(os.getenv("STARK_MOCK_SEED", 0))
+        )
+
+    def async_client(self):
+        """An AsyncOpenAI-shaped view of the same mock (shared settings, counters and random stream)"""
+        return _namespace(chat=_namespace(completions=_AsyncMockCompletions(self)), close=self._aclose)
+
+    async def _aclose(self):
+        pass
+
+    def plan(self, messages, kwargs):
+        """Decide (delay, content, usage) for one call; content is None for an injected failure"""
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            malformed = self._random.random() < self.malformed_rate
+            if fail:
+                self.errors += 1
+            elif malformed:
+                self.malformed += 1
+        if fail:
+            return delay, None, None
+
+        if kwargs.get("response_format", {}).get("type") != "json_object":
+            content = "Summary: the user and Tony talked shop. Tony was brilliant."
+        elif messages and messages[-1]["role"] == "system" and '"steps"' in messages[-1]["content"]:
+            content = json.dumps({"steps": [self._step(name) for name in STEP_ORDER]})
+        else:
+            done = sum(1 for m in messages if m["role"] == "user" and m["content"] == CONTINUE_PROMPT)
+            content = json.dumps(self._step(STEP_ORDER[min(done, len(STEP_ORDER) - 1)]))
+        if malformed:
+            content = content[:len(content) // 2]
+
+        prompt = sum(_estimate_tokens(m.get("content", "")) for m in messages)
+        usage = _namespace(prompt_tokens=prompt, completion_tokens=_estimate_tokens(content), total_tokens=prompt + _estimate_tokens(content))
+        return delay, content, usage
+
+    @staticmethod
+    def _step(name):
+        return {"step": name, "content": MOCK_CONTENT[name], "final": name == "result"}
+
+    @staticmethod
+    def completion(content, usage):
+        message = _namespace(role="assistant", content=content)
+        return _namespace(choices=[_namespace(index=0, message=message, finish_reason="stop")], usage=usage)
+
+    def chunks(self, content, usage, stream_options=None):
+        for i in range(0, len(content), self.chunk_size):
+            delta = _namespace(content=content[i:i + self.chunk_size])
+            yield _namespace(choices=[_namespace(index=0, delta=delta, finish_reason=None)], usage=None)
+        if stream_options and stream_options.get("include_usage"):
+            yield _namespace(choices=[], usage=usage)
+
+    def stats(self):
+        return {"calls": self.calls, "errors": self.errors, "malformed": self.malformed}
+
+
+LLM_BACKENDS = ("openai", "mock")
+
+
+def open_llm_backend(kind, api_key=None):
+    """Sync client for a backend name; None when OpenAI has no API key"""
+    if kind == "mock":
+        return MockLLM.from_env()
+    if kind != "openai":
+        raise ValueError(f"Unknown LLM backend '{kind}' (expected one of {', '.join(LLM_BACKENDS)})")
+    if not api_key:
+        return None
+    from openai import OpenAI  # Imported here: openai and its HTTP stack take a good part of a second to load
+    # resilience.Upstream is the only retry policy: SDK retries would multiply its attempts and hide failures from the breaker
+    return OpenAI(api_key=api_key, max_retries=0)
@@ -0,0 +1,147 @@
+# metrics.py
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Every thread writes to its own shard, so recording never takes a lock or contends
+    with other request threads; a scrape merges the shards. Shards of threads that have
+    exited are folded into a retired total on the next scrape, which keeps servers that
+    start a thread per request (the Flask dev server) from growing without bound.
+    """
+
+    def __init__(self):
+        self._families = {}  # name -> (kind, help, label names, buckets)
+        self._samplers = []  # (name, kind, help, fn, label names) read at scrape time
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()  # Only taken to register a shard and to scrape
+
+    def counter(self, name, help, labels=()):
+        self._families[name] = ("counter", help, tuple(labels), None)
+
+    def gauge(self, name, help, labels=()):
+        self._families[name] = ("gauge", help, tuple(labels), None)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self._families[name] = ("histogram", help, tuple(labels), tuple(buckets))
+
+    def sample(self, name, kind, help, fn, labels=()):
+        """Report fn() under `name` at scrape time, for values owned by another component.
+
+        With `labels`, fn returns {label value (or tuple of values): value}.
+        """
+        self._samplers.append((name, kind, help, fn, tuple(labels)))
+
+    def inc(self, name, labels=(), value=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def dec(self, name, labels=(), value=1):
+        self.inc(name, labels, -value)
+
+    def observe(self, name, value, labels=()):
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the sum
+            counts = shard[key] = [0] * (len(self._families[name][3]) + 2)
+        counts[bisect_left(self._families[name][3], value)] += 1
+        counts[-1] += value
+
+    def value(self, name, labels=()):
+        """Current merged value of a counter or gauge"""
+        return self._collect().get((name, labels), 0)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        collected = self._collect()
+        by_family = {}
+        for (name, labels), value in collected.items():
+            by_family.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help, label_names, buckets) in self._families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_family.get(name, ())):
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(label_names, labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), value):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_format_labels(label_names, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_names, labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(label_names, labels)} {cumulative}")
+        for name, kind, help, fn, label_names in self._samplers:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if not label_names:
+                lines.append(f"{name} {_format_value(fn())}")
+                continue
+            for labels, value in sorted(fn().items()):
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                lines.append(f"{name}{_format_labels(label_names, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _collect(self):
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    # The owner is gone, so nothing else writes to this shard
+                    self._merge(self._retired, shard)
+            self._shards = live
+            merged = {}
+            self._merge(merged, self._retired)
+            for _, shard in live:
+                # dict.copy() is atomic under the GIL, so the owner can keep writing meanwhile
+                self._merge(merged, shard.copy())
+        return merged
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                total = into.get(key)
+                if total is None:
+                    into[key] = list(value)
+                else:
+                    for i, v in enumerate(list(value)):
+                        total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
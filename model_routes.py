@@ -0,0 +1,86 @@
+# model_routes.py
+import json
+import os
+
+# USD per million tokens (prompt, completion), for the cost metrics; a route can set its own
+MODEL_PRICES = {
+    "gpt-4-turbo-preview": (10.0, 30.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+
+ROUTE_FIELDS = ("model", "temperature", "max_tokens", "prompt_price", "completion_price")
+
+
+def _check_route(name, route):
+    if not isinstance(route, dict):
+        raise ValueError(f"Route '{name}' must be an object")
+    unknown = set(route) - set(ROUTE_FIELDS)
+    if unknown:
+        raise ValueError(f"Route '{name}' has unknown fields: {', '.join(sorted(unknown))}")
+    if "model" in route and not (isinstance(route["model"], str) and route["model"]):
+        raise ValueError(f"Route '{name}': model must be a non-empty string")
+    if "max_tokens" in route and (not isinstance(route["max_tokens"], int) or isinstance(route["max_tokens"], bool) or route["max_tokens"] < 1):
+        raise ValueError(f"Route '{name}': max_tokens must be a positive integer")
+    for field in ("temperature", "prompt_price", "completion_price"):
+        value = route.get(field, 0)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"Route '{name}': {field} must be a non-negative number")
+
+
+class ModelRouter:
+    """Model, temperature and max_tokens for each call of the thinking loop.
+
+    Routes are keyed by the step a call is expected to produce (analyze, think, ...,
+    result), plus "single" for the all-steps-at-once call and "summary" for folding
+    older turns into the rolling summary. A route inherits whatever it
+    leaves out from the built-in route of the same name, then from "default". Which step
+    comes back is only known once the reply is parsed, so a stepwise call is routed by
+    how many steps came before it: the first call to "analyze", the fifth and any later
+    ones to "result".
+    """
+
+    def __init__(self, routes, step_order, builtin):
+        """`routes` and `builtin` map route name -> partial route; `builtin` must give "default" in full"""
+        names = ["default"] + list(step_order) + ["single", "summary"]
+        for name, route in routes.items():
+            if name not in names:
+                raise ValueError(f"Unknown route '{name}' (expected one of {', '.join(names)})")
+            _check_route(name, route)
+        self.step_order = list(step_order)
+        default = dict(builtin["default"], **routes.get("default", {}))
+        self.routes = {
+            name: dict(default, **builtin.get(name, {}), **routes.get(name, {}))
+            for name in names[1:]
+        }
+
+    @classmethod
+    def from_config(cls, value, step_order, builtin):
+        """Routing table from JSON text, or from the JSON file it names"""
+        if not value.lstrip().startswith("{"):
+            with open(os.path.expanduser(value), encoding="utf-8") as f:
+                value = f.read()
+        return cls(json.loads(value), step_order, builtin)
+
+    def for_step(self, index):
+        """Route name for the call that should produce step number `index` (0-based)"""
+        return self.step_order[min(index, len(self.step_order) - 1)]
+
+    def request_kwargs(self, name):
+        route = self.routes[name]
+        return {"model": route["model"], "temperature": route["temperature"], "max_tokens": route["max_tokens"]}
+
+    def cost(self, name, model, usage):
+        """USD billed for a call on this route, or None when the model's prices are unknown"""
+        route = self.routes.get(name, {})
+        prices = MODEL_PRICES.get(model, (None, None))
+        prompt_price = route.get("prompt_price", prices[0])
+        completion_price = route.get("completion_price", prices[1])
+        if prompt_price is None or completion_price is None:
+            return None
+        return ((usage.prompt_tokens or 0) * prompt_price + (usage.completion_tokens or 0) * completion_price) / 1e6
+
+    def models(self):
+        return {name: route["model"] for name, route in self.routes.items()}
@@ -0,0 +1,204 @@
+# resilience.py
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+# Statuses worth another attempt: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = frozenset({408, 409, 429})
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+
+
+def is_retryable(error):
+    """Whether an upstream error is transient (and says something about upstream health)"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # openai is imported lazily with its client, and until then none of its errors can occur
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+def retry_after(error):
+    """Seconds from a Retry-After header on the error's response, if any"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Opens after `failure_threshold` transient failures in a row, rejects calls for
+    `reset_timeout` seconds, then lets a single probe through (half-open): success closes
+    it again, failure reopens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Whether a call may go upstream now (claims the probe slot when half-open)"""
+        with self._lock:
+            if self.state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def available(self):
+        """Whether upstream is worth trying, without claiming anything"""
+        return self.state == self.CLOSED or self._clock() - self._opened_at >= self.reset_timeout
+
+    def release(self):
+        """Give back a claimed probe slot without a verdict"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class LatencyTracker:
+    """Recent call latencies, for deciding when a call is slow enough to hedge"""
+
+    def __init__(self, size=256, percentile=95, min_samples=20):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._threshold = None
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        # Re-sorting a few hundred samples on every call would cost more than the hedge saves
+        if len(self._samples) >= self.min_samples and len(self._samples) % 16 == 0:
+            ordered = sorted(self._samples)
+            self._threshold = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def threshold(self):
+        """Latency percentile past which to hedge, or None until enough calls were seen"""
+        return self._threshold
+
+
+class Upstream:
+    """Retry, circuit-breaker and hedging policy for upstream calls.
+
+    attempts() is a generator with no I/O of its own, like the chat pipeline, so the
+    sync and async drivers share one policy: it yields ("call", request_kwargs) and
+    ("sleep", seconds), gets (result, error) back for each call, and returns the result
+    or raises the last error.
+    """
+
+    def __init__(self, breaker=None, max_retries=2, base_delay=0.25, max_delay=4.0, latency=None, rng=random.random):
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency = latency  # LatencyTracker when hedging is enabled
+        self._rng = rng
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backoff(self, attempt, error):
+        """Full-jitter exponential backoff, or the server's Retry-After when it asks for one"""
+        delay = retry_after(error)
+        if delay is None:
+            delay = self._rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+        return min(delay, self.max_delay)
+
+    def hedge_delay(self, request_kwargs):
+        """Seconds to wait before sending a duplicate of this call, or None to not hedge"""
+        if self.latency is None:
+            return None
+        delay = self.latency.threshold()
+        if delay is None or delay >= request_kwargs.get("timeout", float("inf")):
+            return None
+        return delay
+
+    def attempts(self, request_kwargs):
+        deadline = time.monotonic() + request_kwargs.get("timeout", float("inf"))
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("Upstream is unavailable (circuit open)")
+            started = time.monotonic()
+            try:
+                result, error = yield "call", request_kwargs
+            except GeneratorExit:
+                # Abandoned mid-call: don't leave a half-open breaker waiting on this probe forever
+                self.breaker.release()
+                raise
+            if error is None:
+                self.breaker.record_success()
+                if self.latency is not None:
+                    self.latency.observe(time.monotonic() - started)
+                return result
+            if not is_retryable(error):
+                # Upstream answered; the request itself was bad
+                self.breaker.record_success()
+                raise error
+            self.breaker.record_failure()
+
+            delay = self.backoff(attempt, error)
+            remaining = deadline - time.monotonic() - delay
+            if attempt >= self.max_retries or remaining <= 0 or self.breaker.state == CircuitBreaker.OPEN:
+                raise error
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            yield "sleep", delay
+            if "timeout" in request_kwargs:
+                request_kwargs = dict(request_kwargs, timeout=remaining)
+
+    def record_hedge(self, won):
+        with self._lock:
+            self.hedges += 1
+            self.hedge_wins += won
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "rejected": self.breaker.rejected,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -0,0 +1,114 @@
+# response_cache.py
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_message(text):
+    """Canonical form of a user message: case, spacing and trailing punctuation don't matter"""
+    return _WHITESPACE_RE.sub(" ", text.lower()).strip(" .!?")
+
+
+def cache_key(message, history):
+    """Key for a normalized message asked on top of an exact history (list of chat messages)"""
+    digest = hashlib.sha256()
+    for m in history:
+        digest.update(m.get("role", "").encode("utf-8") + b"\0" + m.get("content", "").encode("utf-8") + b"\0")
+    digest.update(b"\1" + normalize_message(message).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe exact-match cache of generated steps with LRU size bound and TTL"""
+
+    def __init__(self, max_entries=1024, ttl=600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, steps)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Cached steps for a key, or None"""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= self._clock():
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(item[1])
+
+    def put(self, key, steps):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, tuple(steps))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """Coalesces concurrent work on the same key: the first caller leads, the rest wait on its Future.
+
+    The Future resolves to the leader's result, or None if the leader failed, in which
+    case followers do the work themselves. Futures work for both threads (result())
+    and asyncio (asyncio.wrap_future), so waiting never ties up a worker thread in
+    the async serving path.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Returns (future, is_leader)"""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def end(self, key, result):
+        """Publish the leader's result (None on failure) and let the next request lead again"""
+        with self._lock:
+            future = self._flights.pop(key, None)
+        if future is not None:
+            future.set_result(result)
+
+    def __len__(self):
+        return len(self._flights)
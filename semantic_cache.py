@@ -0,0 +1,198 @@
+# semantic_cache.py
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Function words carry no topic and are dropped; question words are kept as whole-word features
+# only, so "why does X work" and "how does X work" stay apart
+STOP_WORDS = frozenset("""
+    a an the is are was were be been am do does did done your you yours my me i it its of to in on at for
+    with about and or but this that these those can could would should will please tell explain actually
+    really just some any there here so
+""".split())
+QUESTION_WORDS = {"what": "what", "which": "what", "whats": "what", "how": "how", "hows": "how",
+                  "why": "why", "who": "who", "whos": "who", "when": "when", "where": "where"}
+
+
+class HashingEmbedder:
+    """Local, CPU-only text embedder: signed feature hashing of words, their character n-grams and word bigrams.
+
+    The bigrams get their own `order_weight` share of the vector, so word order counts the
+    same however long the question is - otherwise "convert celsius to fahrenheit" and
+    "convert fahrenheit to celsius" would embed identically. Uses crc32 rather than hash()
+    so vectors are stable across processes and restarts, which keeps a saved index valid.
+    """
+
+    def __init__(self, dim=2048, ngram_range=(3, 5), word_weight=3.0, order_weight=0.5):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.word_weight = word_weight
+        self.order_weight = order_weight
+
+    def words(self, text):
+        """Content words and normalized question words ("q:how"), in order"""
+        for word in _WORD_RE.findall(text.lower().replace("'", "")):
+            if word in QUESTION_WORDS:
+                yield "q:" + QUESTION_WORDS[word]
+            elif word not in STOP_WORDS:
+                yield word
+
+    def features(self, text):
+        low, high = self.ngram_range
+        for word in self.words(text):
+            if word.startswith("q:"):
+                yield word, self.word_weight
+                continue
+            yield "w:" + word, self.word_weight
+            # Character n-grams make plurals, typos and inflections overlap ("reactor"/"reactors")
+            padded = " " + word + " "
+            for n in range(low, high + 1):
+                for i in range(len(padded) - n + 1):
+                    yield padded[i:i + n], 1.0
+
+    def order_features(self, text):
+        words = list(self.words(text))
+        for first, second in zip(words, words[1:]):
+            yield "b:" + first + " " + second, 1.0
+
+    def embed(self, text):
+        # The two parts hash distinct features, so they are close to orthogonal and the cosine of
+        # two embeddings is about (1 - order_weight) * bag-of-words cosine + order_weight * bigram cosine
+        vector = self._hash(self.features(text)) * np.float32(np.sqrt(1.0 - self.order_weight))
+        vector += self._hash(self.order_features(text)) * np.float32(np.sqrt(self.order_weight))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _hash(self, features):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_batch(self, texts):
+        return np.stack([self.embed(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+
+class SemanticCache:
+    """Nearest-neighbour answer cache for context-free questions asked in different words.
+
+    Embeddings live in one preallocated (capacity x dim) float32 matrix, so a lookup is a
+    single matrix-vector product (and lookup_many a matrix-matrix product) over every
+    cached question. When full, the least recently used row is overwritten in place.
+    """
+
+    def __init__(self, capacity=2048, threshold=0.92, embedder=None, clock=time.monotonic):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.embedder = embedder or HashingEmbedder()
+        self._clock = clock
+        self._matrix = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._questions = [None] * capacity
+        self._answers = [None] * capacity
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self._size
+
+    def lookup(self, question):
+        """Cached steps for the closest question above the threshold, or None"""
+        return self.lookup_many([question])[0]
+
+    def lookup_many(self, questions):
+        """Batched lookup: one matrix product for all questions"""
+        queries = self.embedder.embed_batch(questions)
+        with self._lock:
+            if not self._size:
+                self.misses += len(questions)
+                return [None] * len(questions)
+            similarities = queries @ self._matrix[:self._size].T
+            best = similarities.argmax(axis=1)
+            now = self._clock()
+            results = []
+            for row, index in enumerate(best):
+                if similarities[row, index] >= self.threshold:
+                    self._last_used[index] = now
+                    self.hits += 1
+                    results.append(list(self._answers[index]))
+                else:
+                    self.misses += 1
+                    results.append(None)
+            return results
+
+    def put(self, question, steps):
+        vector = self.embedder.embed(question)
+        with self._lock:
+            if self._size:
+                similarities = self._matrix[:self._size] @ vector
+                index = int(similarities.argmax())
+                if similarities[index] < self.threshold:
+                    index = self._free_row()
+            else:
+                index = self._free_row()
+            self._matrix[index] = vector
+            self._questions[index] = question
+            self._answers[index] = tuple(steps)
+            self._last_used[index] = self._clock()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def save(self, path):
+        """Write the index atomically as a compressed .npz (no pickling)"""
+        with self._lock:
+            size = self._size
+            matrix = self._matrix[:size].copy()
+            entries = json.dumps({"questions": self._questions[:size], "answers": [list(a) for a in self._answers[:size]]})
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, matrix=matrix, entries=np.array(entries), dim=np.array(self.embedder.dim),
+                                order_weight=np.array(self.embedder.order_weight))
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Warm the cache from a saved index; returns the number of entries loaded"""
+        with np.load(path, allow_pickle=False) as data:
+            # Vectors from a differently configured embedder would never match new questions
+            if int(data["dim"]) != self.embedder.dim or "order_weight" not in data.files \
+                    or float(data["order_weight"]) != self.embedder.order_weight:
+                return 0
+            matrix = data["matrix"]
+            entries = json.loads(str(data["entries"]))
+        count = min(len(matrix), self.capacity)
+        with self._lock:
+            self._matrix[:count] = matrix[:count]
+            self._questions[:count] = entries["questions"][:count]
+            self._answers[:count] = [tuple(a) for a in entries["answers"][:count]]
+            self._last_used[:count] = self._clock()
+            self._size = count
+        return count
+
+    def _free_row(self):
+        # Caller holds self._lock
+        if self._size < self.capacity:
+            self._size += 1
+            return self._size - 1
+        self.evictions += 1
+        return int(self._last_used.argmin())
@@ -0,0 +1,236 @@
+# snapshots.py
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter
+
+# Snapshot layout, all integers little-endian:
+#   b"STKSNAP2"
+#   records       per conversation: u32 message count, then per message u8 role (| SHARED when
+#                 the content is in the shared table) and u32 byte length (or shared table
+#                 index), followed by the UTF-8 content unless shared
+#   shared table  u32 count, then u32 length + UTF-8 bytes for each text that occurs more
+#                 than once across conversations - mostly the system prompt
+#   index         u32 count, then per conversation, least recently used first: u16 id length,
+#                 id, u64 record offset, u32 record length, u64 history bytes, f64 seconds idle
+#   footer        u64 shared table offset, u64 index offset, f64 wall-clock time written, b"STKSNAP2"
+MAGIC = b"STKSNAP2"
+ROLES = ("system", "user", "assistant", "tool", "developer")
+SHARED = 0x80
+
+_U32 = struct.Struct("<I")
+_MESSAGE = struct.Struct("<BI")
+_INDEX_ENTRY = struct.Struct("<QIQd")
+_FOOTER = struct.Struct("<QQd8s")
+
+
+def write_snapshot(path, conversations):
+    """Write (conversation_id, messages, nbytes, seconds idle) tuples to a snapshot; returns its size in bytes.
+
+    Idle times are relative to the wall-clock time stored in the footer, so a restore
+    can count the time the app was down as idle too.
+
+    The snapshot goes to a temporary file that is fsynced and then renamed over `path`,
+    so a crash mid-write leaves the previous snapshot intact.
+    """
+    conversations = list(conversations)
+    counts = Counter(m["content"] for _, messages, _, _ in conversations for m in messages)
+    shared = [text for text, count in counts.items() if count > 1]
+    shared_ids = {text: i for i, text in enumerate(shared)}
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        index = []
+        for conversation_id, messages, nbytes, idle in conversations:
+            parts = [_U32.pack(len(messages))]
+            for message in messages:
+                role = ROLES.index(message["role"])
+                shared_id = shared_ids.get(message["content"])
+                if shared_id is not None:
+                    parts.append(_MESSAGE.pack(role | SHARED, shared_id))
+                else:
+                    content = message["content"].encode("utf-8")
+                    parts.append(_MESSAGE.pack(role, len(content)))
+                    parts.append(content)
+            record = b"".join(parts)
+            f.write(record)
+            index.append((conversation_id.encode("utf-8"), offset, len(record), nbytes, idle))
+            offset += len(record)
+
+        shared_offset = offset
+        parts = [_U32.pack(len(shared))]
+        for text in shared:
+            data = text.encode("utf-8")
+            parts.append(_U32.pack(len(data)))
+            parts.append(data)
+        block = b"".join(parts)
+        f.write(block)
+
+        index_offset = shared_offset + len(block)
+        parts = [_U32.pack(len(index))]
+        for key, record_offset, length, nbytes, idle in index:
+            parts.append(struct.pack("<H", len(key)) + key + _INDEX_ENTRY.pack(record_offset, length, nbytes, idle))
+        f.write(b"".join(parts))
+        f.write(_FOOTER.pack(shared_offset, index_offset, time.time(), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+class Snapshot:
+    """A snapshot file mapped into memory.
+
+    Opening it reads only the footer, shared table and index - a few dozen bytes per
+    conversation, however long its history - and each record is decoded by `load` on demand.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._map
+        if len(data) < len(MAGIC) + _FOOTER.size or data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a conversation snapshot")
+        shared_offset, index_offset, written_at, magic = _FOOTER.unpack_from(data, len(data) - _FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is truncated")
+        self.size = len(data)
+        self.written_at = written_at  # Wall-clock time; the index's idle times are as of then
+
+        # The shared table is a handful of strings; decode it now
+        self._shared = []
+        pos = shared_offset + _U32.size
+        for _ in range(_U32.unpack_from(data, shared_offset)[0]):
+            length = _U32.unpack_from(data, pos)[0]
+            self._shared.append(data[pos + 4:pos + 4 + length].decode("utf-8"))
+            pos += 4 + length
+
+        self.index = []  # (conversation_id, offset, length, nbytes, idle seconds), least recently used first
+        pos = index_offset + _U32.size
+        for _ in range(_U32.unpack_from(data, index_offset)[0]):
+            key_length = struct.unpack_from("<H", data, pos)[0]
+            conversation_id = data[pos + 2:pos + 2 + key_length].decode("utf-8")
+            pos += 2 + key_length
+            self.index.append((conversation_id,) + _INDEX_ENTRY.unpack_from(data, pos))
+            pos += _INDEX_ENTRY.size
+
+    def __len__(self):
+        return len(self.index)
+
+    def load(self, offset, length):
+        """Decode one conversation's record"""
+        data = self._map
+        end = offset + length
+        pos = offset + _U32.size
+        messages = []
+        for _ in range(_U32.unpack_from(data, offset)[0]):
+            role, value = _MESSAGE.unpack_from(data, pos)
+            pos += _MESSAGE.size
+            if role & SHARED:
+                content = self._shared[value]
+            else:
+                content = data[pos:pos + value].decode("utf-8")
+                pos += value
+            messages.append({"role": ROLES[role & ~SHARED], "content": content})
+        if pos != end:
+            raise ValueError("Corrupt conversation record in snapshot")
+        return messages
+
+
+class Snapshotter:
+    """Restores a ConversationStore from its snapshot, then snapshots it every `interval` seconds.
+
+    A snapshot is only taken when the store changed since the last one, and right away
+    (rather than at the next interval) after a conversation is deleted, so a reset
+    conversation doesn't come back from an old snapshot after a restart.
+    """
+
+    def __init__(self, store, path, interval=60.0):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()  # One snapshot at a time
+        self._saved_changes = None
+        self._thread = None
+        self.snapshots = 0
+        self.failures = 0
+        self.last_bytes = 0
+        self.last_seconds = 0.0
+        self.last_conversations = 0
+        self.last_at = None
+        self.restore_seconds = 0.0
+        self.restored = 0
+
+    def restore(self):
+        """Load the snapshot into the store, if there is one; returns the number of conversations"""
+        if not os.path.exists(self.path):
+            return 0
+        started = time.perf_counter()
+        snapshot = Snapshot(self.path)
+        # Conversations kept idling while the app was down, so expire them by the TTL accordingly
+        downtime = max(0.0, time.time() - snapshot.written_at)
+        self.restored = self.store.restore(
+            (conversation_id, nbytes, idle + downtime, lambda offset=offset, length=length: snapshot.load(offset, length))
+            for conversation_id, offset, length, nbytes, idle in snapshot.index
+        )
+        self.last_bytes = snapshot.size
+        self._saved_changes = self.store.changes
+        self.restore_seconds = time.perf_counter() - started
+        return self.restored
+
+    def save(self):
+        """Snapshot the store now if it changed; returns True if a snapshot was written"""
+        with self._lock:
+            changes = self.store.changes
+            if changes == self._saved_changes:
+                return False
+            started = time.perf_counter()
+            try:
+                conversations = self.store.export()
+                size = write_snapshot(self.path, conversations)
+            except Exception:
+                self.failures += 1
+                raise
+            self._saved_changes = changes
+            self.snapshots += 1
+            self.last_bytes = size
+            self.last_conversations = len(conversations)
+            self.last_seconds = time.perf_counter() - started
+            self.last_at = time.time()
+            return True
+
+    def request(self):
+        """Ask the background thread for a snapshot now"""
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="conversation-snapshots", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.save()
+            except Exception as e:
+                print(f"⚠️ Conversation snapshot failed: {e}")
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "snapshots": self.snapshots,
+            "failures": self.failures,
+            "last_bytes": self.last_bytes,
+            "last_seconds": round(self.last_seconds, 4),
+            "last_conversations": self.last_conversations,
+            "last_at": self.last_at,
+            "restored": self.restored,
+            "restore_seconds": round(self.restore_seconds, 4),
+        }
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache
+
+STEPS = [{"step": "result", "content": "Answer", "final": True}]
+
+
+@pytest.mark.parametrize("question, reversed_question", [
+    ("convert celsius to fahrenheit in python", "convert fahrenheit to celsius in python"),
+    ("is python better than java", "is java better than python"),
+    ("write a python function that converts a list of temperatures from celsius to fahrenheit",
+     "write a python function that converts a list of temperatures from fahrenheit to celsius"),
+])
+def test_reversed_question_misses(question, reversed_question):
+    cache = SemanticCache()
+    cache.put(question, STEPS)
+    assert cache.lookup(reversed_question) is None
+    # And answering it adds an entry instead of overwriting the original question's
+    cache.put(reversed_question, [{"step": "result", "content": "Other answer", "final": True}])
+    assert len(cache) == 2
+    assert cache.lookup(question) == STEPS
+
+
+def test_rephrased_question_hits():
+    cache = SemanticCache()
+    cache.put("How do I reverse a list in Python?", STEPS)
+    assert cache.lookup("how can i reverse a list in python") == STEPS
@@ -0,0 +1,129 @@
+# tracing.py
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+_current = contextvars.ContextVar("stark_trace", default=None)
+_NOOP = nullcontext()
+
+
+def current_trace():
+    return _current.get()
+
+
+def span(name, **attrs):
+    """Time a block as a span of the active trace; a shared no-op when the request isn't sampled"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return trace.span(name, **attrs)
+
+
+class Trace:
+    """Spans recorded for one request, with an optional cProfile capture"""
+
+    def __init__(self, name, profile=False):
+        self.id = os.urandom(8).hex()
+        self.name = name
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.attrs = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.profile = None
+
+    @contextmanager
+    def span(self, name, **attrs):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.perf_counter() - started, **attrs)
+
+    def record(self, name, started, duration, **attrs):
+        """Add a span measured elsewhere (perf_counter start, duration in seconds)"""
+        # list.append is atomic, so spans from the event loop and executor threads can interleave
+        self.spans.append((name, started - self.started, duration, attrs))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attrs": self.attrs,
+            "spans": [
+                dict(attrs, name=name, start_ms=round(start * 1000, 3), duration_ms=round(duration * 1000, 3))
+                for name, start, duration, attrs in sorted(self.spans, key=lambda s: s[1])
+            ],
+            "profile": self.profile,
+        }
+
+
+class Tracer:
+    """Samples a fraction of requests into traces and keeps the most recent ones in a ring buffer.
+
+    Unsampled requests get no Trace at all, so every span() along their way is a single
+    ContextVar lookup returning a shared no-op context manager.
+    """
+
+    def __init__(self, sample_rate=0.0, capacity=200, profile_top=30):
+        self.sample_rate = sample_rate
+        self.profile_top = profile_top
+        self._traces = deque(maxlen=capacity)
+        self._profiler_lock = threading.Lock()  # cProfile can't run twice at once in one process
+
+    def begin(self, name, force=False, profile=False):
+        """A new Trace if this request is sampled (or forced), otherwise None"""
+        if not (force or profile or (self.sample_rate > 0 and random.random() < self.sample_rate)):
+            return None
+        return Trace(name, profile=profile)
+
+    @contextmanager
+    def activate(self, trace, profile=True):
+        """Make `trace` current for the block (and run its profiler in this thread, if any)"""
+        if trace is None or _current.get() is trace:
+            yield trace
+            return
+        token = _current.set(trace)
+        profiler = trace.profiler if profile else None
+        if profiler is not None and not self._profiler_lock.acquire(blocking=False):
+            profiler = None  # Another request is being profiled; keep the spans, skip the profile
+        try:
+            if profiler is not None:
+                profiler.enable()
+            yield trace
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiler_lock.release()
+            _current.reset(token)
+
+    def finish(self, trace, **attrs):
+        if trace is None:
+            return
+        trace.duration = time.perf_counter() - trace.started
+        trace.attrs.update(attrs)
+        if trace.profiler is not None:
+            out = io.StringIO()
+            try:
+                pstats.Stats(trace.profiler, stream=out).sort_stats("cumulative").print_stats(self.profile_top)
+                trace.profile = out.getvalue()
+            except TypeError:
+                # Nothing was captured
+                trace.profile = None
+            trace.profiler = None
+        self._traces.append(trace)
+
+    def recent(self, limit=None):
+        """Finished traces, newest first"""
+        traces = list(self._traces)[::-1]
+        return [t.to_dict() for t in traces[:limit]]